@@ -0,0 +1,47 @@
+# Purpose: client of the answer API (api_server.py), used by the Streamlit UI
+
+import json
+import os
+
+import requests
+
+def api_url() -> str:
+    from api_server import API_PORT
+    return os.environ.get('ANSWER_API_URL', f'http://localhost:{API_PORT}').rstrip('/')
+
+def parse_events(lines):
+    "(event, data) pairs from the lines of a text/event-stream"
+    event, data = 'message', []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads('\n'.join(data))
+            event, data = 'message', []
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data.append(line[5:].strip())
+
+def stream_answer(prompt, history, who, language, session=requests, session_id=None, timeout=(5, 120)):
+    """Yields the (event, data) pairs of service.answer_events() for one turn.
+    history: {'role', 'content'} dicts; other keys are not sent.
+    session_id: the user's session, for fair queuing of upstream calls on the server"""
+    response = session.post(f'{api_url()}/answer', json={
+        'prompt': prompt,
+        'history': [ {'role': message['role'], 'content': message['content']} for message in history ],
+        'who': who,
+        'language': language,
+        'session': session_id,
+    }, stream=True, timeout=timeout)
+    with response:
+        response.raise_for_status()
+        yield from parse_events(response.iter_lines(decode_unicode=True))
+
+def get_stats(session=requests, timeout=1.0):
+    "Response cache, latency and upstream queue stats of one API worker, or None if it can't be reached"
+    try:
+        response = session.get(f'{api_url()}/stats', timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException:
+        return None
@@ -0,0 +1,99 @@
+# Purpose: headless HTTP API for the answer pipeline, streaming each turn as server-sent events
+#
+# POST /answer  {"prompt", "history": [{"role", "content"}], "who", "language", "session"}
+#   -> text/event-stream, one SSE event per service.answer_events() event, data as JSON
+#   Upstream calls are queued fairly per "session" (default: the client address).
+# GET  /stats   response cache stats, per-stage latency percentiles and upstream queues of this worker
+# GET  /health
+#
+# Usage: python api_server.py [--port 8504] [--workers 4]
+# Several worker processes accept on the same port (SO_REUSEPORT); each holds its own
+# clients, caches and 1/workers share of the upstream quotas. Worker n serves its metrics on METRICS_PORT + n. Audio URLs
+# point at the audio endpoint, which the workers share through the on-disk blob store.
+
+import argparse
+import json
+import multiprocessing
+import os
+
+from aiohttp import web
+
+API_PORT = 8504
+
+async def answer(request):
+    from scheduler import upstream_context
+    from service import answer_events
+    try:
+        body = await request.json()
+        prompt = body['prompt']
+    except (ValueError, KeyError):
+        raise web.HTTPBadRequest(text='expected a JSON body with a "prompt"')
+    history = [ {'role': message['role'], 'content': message['content']} for message in body.get('history', []) ]
+    if not history or history[-1]['content'] != prompt:
+        history.append({'role': 'user', 'content': prompt})
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    events = answer_events(prompt, history, body.get('who', ''), body.get('language', 'English'))
+    try:
+        # set in this request's task only; executor threads get a copy of it
+        with upstream_context(session=body.get('session') or request.remote):
+            async for event, data in events:
+                await response.write(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode())
+    finally:
+        # closed here, in the request's task, if the client went away mid-answer
+        await events.aclose()
+    await response.write_eof()
+    return response
+
+async def stats(request):
+    from response_cache import default_response_cache
+    from scheduler import default_scheduler
+    from tracing import default_tracer
+    return web.json_response({
+        'response_cache': default_response_cache().stats(), 'latency': default_tracer().snapshot(),
+        'upstream': default_scheduler().stats()
+    })
+
+async def health(request):
+    return web.json_response({'ok': True})
+
+def make_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post('/answer', answer)
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/health', health)
+    return app
+
+def serve(host: str, port: int, worker: int = 0, reuse_port: bool = False, workers: int = 1) -> None:
+    from resources import metrics_server
+    from scheduler import share_quotas
+    from tracing import METRICS_PORT
+    # each worker has its own scheduler; together they keep to the configured quotas
+    share_quotas(workers)
+    os.environ['METRICS_PORT'] = str(int(os.environ.get('METRICS_PORT', METRICS_PORT)) + worker)
+    metrics_server()
+    web.run_app(make_app(), host=host, port=port, reuse_port=reuse_port or None, print=None)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the answer pipeline over HTTP')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('API_PORT', API_PORT)))
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'Serving on {args.host}:{args.port} with {args.workers} worker(s)')
+    if args.workers == 1:
+        serve(args.host, args.port)
+    else:
+        # every worker binds the port itself; the kernel spreads connections across them
+        workers = [
+            multiprocessing.Process(target=serve, args=(args.host, args.port, n, True, args.workers), daemon=True)
+            for n in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
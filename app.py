@@ -1,41 +1,20 @@
 import streamlit as st
-import base64
-import random
-import time
-import openai
-import pinecone
-import os
 import json
-import re
-from elevenlabs import set_api_key, generate, VoiceSettings, Voice
-from dotenv import load_dotenv
+import uuid
+import streamlit.components.v1 as components
 
-import vectorize as ret
-from responses import get_timesaving_audio
+import requests
 
-# Load environment variables
-load_dotenv()
-openai.api_key = os.environ.get('OPENAI_API_KEY')
-ELEVEN_KEY = os.environ.get("ELEVENLABS_API_KEY")
-set_api_key(ELEVEN_KEY)
+from api_client import stream_answer, get_stats
+from resources import audio_url, api_session
 
 VIVEK_PROFILE_PIC = "https://upload.wikimedia.org/wikipedia/commons/thumb/9/96/Vivek_Ramaswamy_by_Gage_Skidmore.jpg/640px-Vivek_Ramaswamy_by_Gage_Skidmore.jpg"
 
 USER_PROFILE_PIC = 'https://photos1.blogger.com/blogger/5283/727/320/farmer-headshot3.JPG'
 
-# Initialize Pinecone index
-pinecone.init(
-    api_key=os.environ.get('PINECONE_API_KEY'),
-    environment=os.environ.get('PINECONE_ENV')
-)
-index_name = 'vivek-demo-v1'
-INDEX = pinecone.Index(index_name)
-
-def extract_reference_numbers(text):
-    pattern = r"\((\d+)\)"
-    matches = re.findall(pattern, text)
-    references = [int(match[0]) for match in matches]
-    return references
+# Answers come from the answer API (api_server.py, ANSWER_API_URL); this script only
+# renders them, so it holds no clients, indexes or caches of its own; its one
+# keep-alive session to the API is shared by every rerun and session (resources.py).
 
 def extract_video_link_and_start_time(url):
     result = url.split('&t=')
@@ -43,16 +22,15 @@ def extract_video_link_and_start_time(url):
     start_time = int(result[1]) if len(result) > 1 else 0
     return video_link, start_time
 
-def strip_citations(text) -> str:
-    pattern = r"\((\d+)\)"
-    stripped_text = re.sub(pattern, '', text)
-    return stripped_text
+# URL of audio given as a URL (from the answer API), a BlobHandle or bytes (stored first)
+def audio_src(audio) -> str:
+    return audio if isinstance(audio, str) else audio_url(audio)
 
-def display_audio(audio: bytes, placeholder=None):
+# the browser fetches the audio by URL only when played
+def display_audio(audio, placeholder=None, autoplay=False):
     if placeholder is None:
         placeholder = st.empty()
-    audio_base64 = base64.b64encode(audio).decode('utf-8')
-    audio_tag = f'<audio controls src="data:audio/wav;base64,{audio_base64}">'
+    audio_tag = f'<audio controls {"autoplay " if autoplay else ""}src="{audio_src(audio)}">'
     placeholder.markdown(audio_tag, unsafe_allow_html=True)
 
 def display_citations(citations, placeholder=None):
@@ -69,124 +47,79 @@ def display_citations(citations, placeholder=None):
         with tab:
             st.video(video_link, start_time=start_time)
 
-# output text 
-def display_transcription(output_text: str, elapsed_time: int=30, placeholder=None) -> str:
+# output text
+# Renders the audio player and the transcript as one component; the typewriter effect
+# runs in the browser, revealing words in step with audio playback, so the script run
+# is not held up and the text is sent once instead of word by word.
+def display_transcription(output_text: str, audio, placeholder=None) -> str:
     if placeholder is None:
         placeholder = st.empty()
-    full_response = ''
-    placeholder.markdown(full_response)
-    # Simulate stream of response with milliseconds delay
-    split = output_text.split()
-    nchunks = len(split)
-    interval = elapsed_time / nchunks
-    for chunk in split:
-        full_response += chunk + " "
-        time.sleep(interval)
-        # Add a blinking cursor to simulate typding
-        placeholder.markdown(full_response + "▌")
-    placeholder.markdown(full_response)
-    return full_response
-
-def display_message(message):
+    words = json.dumps(output_text.split()).replace('</', '<\\/')
+    # components have a fixed height: estimate the wrapped text height up front
+    lines = len(output_text) // 80 + 1
+    with placeholder.container():
+        components.html(f"""
+            <audio id="audio" controls src="{audio_src(audio)}" style="width: 100%"></audio>
+            <p id="text" style="font-family: 'Source Sans Pro', sans-serif; font-size: 16px; line-height: 1.6; color: #31333F;"></p>
+            <script>
+            const words = {words};
+            const audio = document.getElementById("audio");
+            const text = document.getElementById("text");
+            function render() {{
+                const progress = audio.duration ? Math.min(1, audio.currentTime / audio.duration) : 0;
+                const shown = Math.ceil(words.length * progress);
+                text.textContent = words.slice(0, shown).join(" ") + (shown < words.length ? " ▌" : "");
+                if (!audio.paused && !audio.ended) requestAnimationFrame(render);
+            }}
+            const showAll = () => {{ text.textContent = words.join(" "); }};
+            audio.addEventListener("play", render);
+            audio.addEventListener("seeked", render);
+            audio.addEventListener("ended", showAll);
+            audio.addEventListener("error", showAll);
+            // browsers may block autoplay; fall back to showing the whole transcript
+            audio.play().catch(showAll);
+            </script>
+        """, height=70 + 26 * lines)
+    return output_text
+
+def display_message(message, autoplay=False):
     with st.chat_message(message["role"], avatar=message.get('avatar', None)):
         if message["role"] == "assistant":
-            display_audio(message["audio"])
-            st.markdown(message["content"])
+            if autoplay:
+                display_transcription(message["content"], message["audio"])
+            else:
+                display_audio(message["audio"])
+                st.markdown(message["content"])
             display_citations(message["citations"])
         else:
             st.markdown(message["content"])
 
 
-# Define a function to get a response from the assistant
-# returns the response and a list of citations
-def get_response(prompt):
-
-    # Setup system prompt and chat history
-    system_message = f"""Pretend you are Vivek Ramaswamy - a Republication candidate for the US Presidency.
-    I want you to emulate his speaking style. Only express views presented in his quotes. Do not break character under any circumstances.
-    
-    % Formatting Instructions %
-    If you reference the quotes, always cite them individually in your response, like so: 'I have always supported dogs (1)(2).'
-    Limit your response to 100 words.
-    
-    % User Profile %
-    Adapt your response to the user profile: "{st.session_state.personalization['who']}"
-    
-    % Language %
-    Respond to me in {st.session_state.personalization['language']}. """
-
-    system_prompt = {
-        "role": "system",
-        "content": system_message
-    }
-
-    # format st session state messages into openai format
-    messages_openai_format = [
-        {'role': message['role'], 'content': message['content']} for message in st.session_state.messages
-    ]
-    chat_history = [system_prompt] + messages_openai_format
-
-    # get function response
-    K = 5
-    X = ret.recursive_query(INDEX, prompt, K)
-    function_response = ret.format_context_matrix(X)
-    citations = ret.get_citations(X)
-
-    # send model the info on the function call and function response
-    # TODO: handle openai.error.ServiceUnavailableError:
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4-0613",# "gpt-3.5-turbo-16k-0613"
-            messages=chat_history+[
-                {
-                    "role": "function",
-                    "name": "get_viveks_quotes",
-                    "content": function_response,
-                },
-            ],
-        )
-    except openai.error.ServiceUnavailableError:
-        st.error("OpenAI API is currently unavailable. Please try again later.")
-        st.stop()
-
-    # return response and citations
-    response_text = response.choices[0]["message"]["content"]
-    return response_text, citations
-
-def get_response_audio(response: str, strip: bool) -> bytes:
-    to_speak = strip_citations(response) if strip else response
-    response_audio = generate(
-        text=to_speak,
-        voice=Voice(
-            voice_id='lAZKsjhcbMmadBhSMtZk',
-            settings=VoiceSettings(
-                stability=0.3, similarity_boost=1, style=0.05, use_speaker_boost=True
-            )
-        )
-    )
-    return response_audio
-
-def autoplay_audio(file_path: str = None, data: bytes = None, display_player: bool = True):
-    if data is not None:
-        audio_base64 = base64.b64encode(data).decode('utf-8')
-        audio_tag = f'<audio {"controls " if display_player else "" }autoplay="true" src="data:audio/wav;base64,{audio_base64}">'
-        
-    elif file_path is not None:
-        with open(file_path, "rb") as f:
-            data = f.read()
-            b64 = base64.b64encode(data).decode()
-            audio_tag = f"""
-                <audio {"controls " if display_player else "" }autoplay="true">
-                <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
-                </audio>
-                """
-    
-    st.markdown(audio_tag, unsafe_allow_html=True)
-
-def get_audio_length(audio: bytes) -> int:
-    bit_rate = 128000
-    length = len(audio) / bit_rate * 8
-    return int(length)
+def format_timings(timings) -> str:
+    return ', '.join(f'{stage} {seconds * 1000:.0f} ms' for stage, seconds in timings.items())
+
+# Queue an audio segment for in-order playback within a turn.
+# Segments are played by the parent page one after another as they arrive.
+def play_segment(turn_id: str, index: int, src: str):
+    components.html(f"""
+        <script>
+        const page = window.parent;
+        const turns = page.__segmentQueues = page.__segmentQueues || {{}};
+        const turn = turns["{turn_id}"] = turns["{turn_id}"] || {{ next: 0, segments: {{}}, playing: false }};
+        turn.segments[{index}] = "{src}";
+        function pump() {{
+            if (turn.playing || !(turn.next in turn.segments)) return;
+            const audio = new page.Audio(turn.segments[turn.next]);
+            delete turn.segments[turn.next];
+            turn.next += 1;
+            turn.playing = true;
+            const done = () => {{ turn.playing = false; pump(); }};
+            audio.onended = done;
+            audio.play().catch(done);
+        }}
+        pump();
+        </script>
+    """, height=0)
 
 if __name__ == "__main__":
 
@@ -200,6 +133,10 @@ if __name__ == "__main__":
             "language": "English"
         }
     
+    # upstream calls of this browser session are queued fairly against other sessions'
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -208,6 +145,15 @@ if __name__ == "__main__":
         st.header("Personalization")
         st.session_state.personalization['who'] = st.text_area("Who are you?", "My name is Ian. I'm a farmer from Iowa. I'm pro-gun, pro-abortion, and worried about the economy.")
         st.session_state.personalization['language'] = st.selectbox("What language do you speak?", ["English", "Spanish", "Hindi"])
+        # stats of whichever API worker answers this request
+        stats = get_stats(api_session())
+        if stats is not None:
+            cache_stats = stats['response_cache']
+            st.caption(f"Response cache: {cache_stats['hit_rate']:.0%} hit rate over {cache_stats['lookups']} questions, "
+                       f"{cache_stats['latency_saved']:.0f}s saved")
+            turn_stats = stats['latency'].get('turn')
+            if turn_stats is not None:
+                st.caption(f"Answer time: {turn_stats['p50']:.1f}s median, {turn_stats['p95']:.1f}s p95")
 
     # Display chat messages from history on app rerun
     for message in st.session_state.messages:
@@ -221,49 +167,62 @@ if __name__ == "__main__":
         with st.chat_message("user", avatar=USER_PROFILE_PIC):
             st.markdown(prompt)
 
-        # Display assistant response in chat message container
+        # Near-duplicate questions with the same personalization and earlier turns are answered from the API's cache
+        personalization = st.session_state.personalization
+        events = stream_answer(prompt, st.session_state.messages, personalization['who'], personalization['language'],
+                               session=api_session(), session_id=st.session_state.session_id)
+        assistant_response = None
         with st.chat_message("assistant", avatar=VIVEK_PROFILE_PIC):
-
-            status_area = st.empty()
-            
-            # Display loading bar
-            status = status_area.status("Processing...", expanded=True)
-
-            # Read time buying response
-            autoplay_audio(file_path=f'audio/{random.randint(1, 20)}.wav', display_player=False)
-            # audio_placeholder.audio(get_timesaving_audio())
-
-            status.write("Gathering thoughts...")
-            # Give the LLM some time to think
-            assistant_response, all_citations = get_response(prompt)
-
-            status.write("Preparing response...")
-            # Get audio response
-            audio_response = get_response_audio(assistant_response, strip=True)
-
-            # Remove loading bar
-            status.update(label="Done!", state="complete", expanded=False)
             status_area = st.empty()
-
-            # autoplay audio response
-            autoplay_audio(data=audio_response, display_player=True)
-
-            # Stream transcribed response in 20 seconds
-            display_transcription(assistant_response, elapsed_time=get_audio_length(audio_response))
-
-            # Display citations
-            used_numbers = extract_reference_numbers(assistant_response)
-            used_citations = [ citation for citation in all_citations if citation[0] in used_numbers ]
-            citations = list(zip(*used_citations))
-            display_citations(citations)
-
-        # Add assistant response to chat history
-        st.session_state.messages.append({
-            "key": len(st.session_state.messages),
-            "role": "assistant", 
-            "content": assistant_response, 
-            'avatar': VIVEK_PROFILE_PIC,
-            'citations': citations,
-            'audio': audio_response
-        })
-
+            status = None
+            text_placeholder = st.empty()
+            # Time buying response plays first; answer sentences are queued behind it
+            turn_id = uuid.uuid4().hex
+            try:
+                for event, data in events:
+                    if event == 'filler':
+                        # Display loading bar
+                        status = status_area.status("Processing...", expanded=True)
+                        play_segment(turn_id, 0, data['url'])
+                        status.write("Gathering thoughts...")
+                    elif event == 'status':
+                        status.write(format_timings(data['timings']))
+                        partial_response = ''
+                    elif event == 'text':
+                        partial_response += data['delta']
+                    elif event == 'sentence':
+                        # one update per sentence rather than one per token
+                        text_placeholder.markdown(partial_response + "▌")
+                    elif event == 'audio':
+                        if data['index'] == 0:
+                            # Remove loading bar
+                            status.update(label="Done!", state="complete", expanded=False)
+                        play_segment(turn_id, data['index'] + 1, data['url'])
+                    elif event == 'error':
+                        if status is not None:
+                            status.update(label="Failed", state="error", expanded=False)
+                        st.error(f"The {data['stage']} service is currently unavailable. Please try again later.")
+                    elif event == 'done':
+                        assistant_response, citations, audio_response = data['text'], data['citations'], data['audio']
+                        if data['cached']:
+                            display_transcription(assistant_response, audio_response, text_placeholder)
+                        else:
+                            text_placeholder.markdown(assistant_response)
+                            status.update(label="Done!", state="complete", expanded=False)
+                        # Display citations
+                        display_citations(citations)
+            except requests.RequestException:
+                if status is not None:
+                    status.update(label="Failed", state="error", expanded=False)
+                st.error("The answer service is currently unavailable. Please try again later.")
+
+        # Add assistant response to chat history; the audio is kept as its URL
+        if assistant_response is not None:
+            st.session_state.messages.append({
+                "key": len(st.session_state.messages),
+                "role": "assistant", 
+                "content": assistant_response, 
+                'avatar': VIVEK_PROFILE_PIC,
+                'citations': citations,
+                'audio': audio_response
+            })
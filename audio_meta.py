@@ -0,0 +1,146 @@
+# Purpose: exact audio durations from WAV / MP3 headers, without decoding
+#
+# The format is sniffed from the bytes, not the file name: the filler clips in
+# audio/ are MP3 data saved with a .wav extension.
+
+import struct
+
+# kbps by [version row][layer][bitrate index]; version row 0 = MPEG1, 1 = MPEG2/2.5
+_BITRATES = {
+    (0, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (0, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (0, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (1, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (1, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (1, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Hz by version bits (3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5)
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def audio_format(data: bytes):
+    "Returns 'wav', 'mp3' or None"
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        return 'wav'
+    offset = _skip_id3(data, 0)
+    header = _parse_header(data, offset)
+    # require a second frame right after the first, so random bytes aren't taken for MPEG
+    if header is not None and (offset + header[0] >= len(data) or _parse_header(data, offset + header[0])):
+        return 'mp3'
+    return None
+
+def mime_type(data: bytes) -> str:
+    return {'wav': 'audio/wav', 'mp3': 'audio/mpeg'}.get(audio_format(data), 'application/octet-stream')
+
+def wav_duration(data: bytes) -> float:
+    byte_rate = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, offset)
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack_from('<I', data, body + 8)[0]
+        elif chunk_id == b'data':
+            if byte_rate is None:
+                raise ValueError('WAV data chunk before fmt chunk')
+            # streamed WAVs may leave the size unset; use what is actually there
+            size = min(size, len(data) - body)
+            return size / byte_rate
+        offset = body + size + (size & 1)
+    raise ValueError('WAV without data chunk')
+
+def _parse_header(data, offset):
+    "Returns (frame length, samples per frame, sample rate, side info size) or None"
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset:offset + 4]
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    row = 0 if version == 3 else 1
+    bitrate = _BITRATES[(row, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 3 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    mono = (b3 >> 6) == 3
+    side_info = (32 if not mono else 17) if version == 3 else (17 if not mono else 9)
+    return length, samples, sample_rate, side_info
+
+def _skip_id3(data, offset):
+    while data[offset:offset + 3] == b'ID3' and offset + 10 <= len(data):
+        size = 0
+        for byte in data[offset + 6:offset + 10]:
+            size = (size << 7) | (byte & 0x7F)
+        footer = 10 if data[offset + 5] & 0x10 else 0
+        offset += 10 + size + footer
+    return offset
+
+def _find_frame(data, offset, limit=4096):
+    "Offset of the next valid frame header at or after `offset`, scanning at most `limit` bytes"
+    end = min(len(data) - 3, offset + limit)
+    while offset < end:
+        offset = data.find(b'\xff', offset, end)
+        if offset < 0:
+            return None
+        if _parse_header(data, offset) is not None:
+            return offset
+        offset += 1
+    return None
+
+def _vbr_frames(data, offset, header):
+    "Frame count from a Xing/Info or VBRI header in the first frame, plus its byte count if known"
+    length, _, _, side_info = header
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack_from('>I', data, xing + 4)[0]
+        if flags & 1:
+            frames = struct.unpack_from('>I', data, xing + 8)[0]
+            nbytes = struct.unpack_from('>I', data, xing + 12)[0] if flags & 2 else None
+            return frames, nbytes
+    vbri = offset + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        nbytes, frames = struct.unpack_from('>II', data, vbri + 10)
+        return frames, nbytes
+    return None
+
+def mp3_duration(data: bytes) -> float:
+    offset = _find_frame(data, _skip_id3(data, 0))
+    if offset is None:
+        raise ValueError('no MPEG audio frame found')
+    header = _parse_header(data, offset)
+    vbr = _vbr_frames(data, offset, header)
+    if vbr is not None:
+        frames, nbytes = vbr
+        # trust the header unless more audio follows it (e.g. concatenated streams)
+        if nbytes is None or offset + nbytes >= len(data) - 128:
+            return frames * header[1] / header[2]
+
+    # walk the frame headers and add up their samples
+    seconds = 0.0
+    while offset is not None:
+        header = _parse_header(data, offset)
+        # a Xing/Info frame carries no audio
+        if _vbr_frames(data, offset, header) is None:
+            seconds += header[1] / header[2]
+        offset = _skip_id3(data, offset + header[0])
+        if _parse_header(data, offset) is None:
+            offset = _find_frame(data, offset)
+    return seconds
+
+def duration(data: bytes) -> float:
+    "Duration in seconds of WAV or MP3 bytes"
+    fmt = audio_format(data)
+    if fmt == 'wav':
+        return wav_duration(data)
+    if fmt == 'mp3':
+        return mp3_duration(data)
+    raise ValueError('unrecognized audio format')
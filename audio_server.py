@@ -0,0 +1,107 @@
+# Purpose: serve stored audio by URL, with HTTP range requests
+#
+# The browser fetches /audio/<key> from this endpoint instead of receiving the
+# audio inline as a base64 data URI in every page payload. Blobs are immutable
+# (content-addressed), so responses are cacheable forever.
+
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import audio_meta
+
+AUDIO_SERVER_PORT = 8502
+CHUNK_SIZE = 64 * 1024
+PATH_PATTERN = re.compile(r'^/audio/([0-9a-f]{64})(?:\.\w+)?$')
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class AudioRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _error(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        match = PATH_PATTERN.match(self.path.split('?')[0])
+        if match is None:
+            return self._error(404)
+        key = match.group(1)
+        path = self.server.store.file(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return self._error(404)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            etag = f'"{key}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._error(304, [('ETag', etag)])
+
+            start, end, status = 0, size - 1, 200
+            requested = self.headers.get('Range')
+            if requested:
+                range_match = RANGE_PATTERN.match(requested.strip())
+                if range_match is None or range_match.groups() == ('', ''):
+                    return self._error(416, [('Content-Range', f'bytes */{size}')])
+                first, last = range_match.groups()
+                if first:
+                    start = int(first)
+                    end = min(int(last), size - 1) if last else size - 1
+                else:
+                    # suffix range: the last N bytes
+                    start = max(0, size - int(last))
+                if start >= size or start > end:
+                    return self._error(416, [('Content-Range', f'bytes */{size}')])
+                status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', audio_meta.mime_type(f.read(4096)))
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if not body:
+                return
+            if start == 0:
+                # playback started: keep the blob from being evicted as unused
+                self.server.store.touch(key)
+
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+class AudioServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, store, host='0.0.0.0', port=AUDIO_SERVER_PORT) -> None:
+        super().__init__((host, port), AudioRequestHandler)
+        self.store = store
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+def audio_path(handle) -> str:
+    "URL path for a BlobHandle"
+    return f'/audio/{handle.key}' + (f'.{handle.format}' if handle.format else '')
@@ -0,0 +1,209 @@
+# Purpose: vector-search backends used by recursive_query and the upsert loop
+#
+# Every backend speaks the subset of the pinecone.Index API the app relies on and
+# returns the same shapes:
+#   query(vector, top_k)  -> {'matches': [{'id', 'score', 'metadata'}, ...]}
+#   fetch(ids)            -> {'vectors': {id: {'id', 'values', 'metadata'}}}
+#   upsert(vectors)       with vectors an iterable of (id, values, metadata)
+#   delete(ids)
+#   flush()               persist buffered writes (no-op for Pinecone)
+
+import json
+import os
+import numpy as np
+from chunk_store import ChunkStore, write_chunk_store
+import scheduler
+
+PINECONE_INDEX_NAME = 'vivek-demo-v1'
+LOCAL_INDEX_PATH = './vivek_embeds/local_index'
+
+class VectorBackend:
+    def query(self, vector, top_k=10, include_metadata=True, include_values=False) -> dict:
+        raise NotImplementedError
+
+    def fetch(self, ids) -> dict:
+        raise NotImplementedError
+
+    def upsert(self, vectors) -> None:
+        raise NotImplementedError
+
+    def delete(self, ids) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+class PineconeBackend(VectorBackend):
+    def __init__(self, index) -> None:
+        self.index = index
+
+    # requests go through the process-wide scheduler (scheduler.py); identical
+    # queries and fetches in flight at the same time are sent once
+    def query(self, vector, top_k=10, include_metadata=True, include_values=False) -> dict:
+        vector = list(vector)
+        key = ('query', np.asarray(vector, dtype=np.float32).tobytes(), top_k, include_metadata, include_values)
+        return scheduler.call('pinecone', lambda: self.index.query(
+            vector=vector, top_k=top_k, include_metadata=include_metadata, include_values=include_values
+        ), key=key)
+
+    def fetch(self, ids) -> dict:
+        ids = list(ids)
+        return scheduler.call('pinecone', lambda: self.index.fetch(ids=ids), key=('fetch', tuple(sorted(ids))))
+
+    def upsert(self, vectors) -> None:
+        vectors = list(vectors)
+        scheduler.call('pinecone', lambda: self.index.upsert(vectors=vectors))
+
+    def delete(self, ids) -> None:
+        # Pinecone accepts at most 1000 ids per delete request
+        ids = list(ids)
+        for i in range(0, len(ids), 1000):
+            batch = ids[i:i+1000]
+            scheduler.call('pinecone', lambda: self.index.delete(ids=batch))
+
+def _unit(mat):
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return mat / norms
+
+class LocalIndex(VectorBackend):
+    """Exact cosine top-K over one contiguous float32 matrix, memory-mapped from disk.
+
+    Directory layout:
+      vectors.f32   row-major (count x dim) unit-normalized embeddings
+      ids.npy       chunk id of each row (sha256 hex, as produced by node.hash_string)
+      index.json    {'count', 'dim'}
+      chunks.*      metadata, see chunk_store.py
+    Writes are buffered in memory and persisted by flush().
+    """
+    def __init__(self, path: str = LOCAL_INDEX_PATH, dim: int = None) -> None:
+        self.path = path
+        self.dim = dim
+        self.matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self.ids = np.empty(0, dtype='U64')
+        self.store = None
+        self.overlay = {}    # metadata of rows written since the last flush
+        self.pending = {}    # id -> (values, metadata) not yet merged into the matrix
+        self.deleted = set()
+        self._rows = None
+        if os.path.exists(os.path.join(path, 'index.json')):
+            self._load()
+
+    def _load(self):
+        with open(os.path.join(self.path, 'index.json')) as f:
+            info = json.load(f)
+        self.dim = info['dim']
+        count = info['count']
+        if count:
+            self.matrix = np.memmap(os.path.join(self.path, 'vectors.f32'), dtype=np.float32,
+                                    mode='r', shape=(count, self.dim))
+            self.ids = np.load(os.path.join(self.path, 'ids.npy'), mmap_mode='r')
+        else:
+            self.matrix = np.empty((0, self.dim or 0), dtype=np.float32)
+            self.ids = np.empty(0, dtype='U64')
+        self.store = ChunkStore(self.path)
+        self.overlay = {}
+        self._rows = None
+
+    def __len__(self) -> int:
+        self._compact()
+        return len(self.ids)
+
+    def _row_of(self, id):
+        if self._rows is None:
+            self._rows = { str(id): i for i, id in enumerate(self.ids) }
+        return self._rows.get(id)
+
+    def _metadata(self, id):
+        if id in self.overlay:
+            return self.overlay[id]
+        return self.store.get(id) if self.store is not None else None
+
+    def _compact(self):
+        "Merges buffered upserts and deletes into the in-memory matrix"
+        if not self.pending and not self.deleted:
+            return
+        drop = self.deleted | self.pending.keys()
+        keep = np.array([ str(id) not in drop for id in self.ids ], dtype=bool)
+        new_ids = list(self.pending)
+        new_rows = np.array([ values for values, _ in self.pending.values() ], dtype=np.float32)
+        new_rows = _unit(new_rows.reshape(len(new_ids), self.dim))
+        self.matrix = np.concatenate([np.asarray(self.matrix[keep]), new_rows])
+        self.ids = np.concatenate([np.asarray(self.ids[keep]), np.array(new_ids, dtype=str)])
+        for id in self.deleted:
+            self.overlay.pop(id, None)
+        self.pending, self.deleted, self._rows = {}, set(), None
+
+    def query(self, vector, top_k=10, include_metadata=True, include_values=False) -> dict:
+        self._compact()
+        n = len(self.ids)
+        k = min(top_k, n)
+        if k == 0:
+            return {'matches': []}
+        # accept both a flat vector and Pinecone's [vector] form
+        q = _unit(np.asarray(vector, dtype=np.float32).reshape(-1))
+        scores = self.matrix @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        matches = []
+        for i in top:
+            id = str(self.ids[i])
+            match = {'id': id, 'score': float(scores[i])}
+            if include_metadata:
+                match['metadata'] = self._metadata(id)
+            if include_values:
+                match['values'] = self.matrix[i].tolist()
+            matches.append(match)
+        return {'matches': matches}
+
+    def fetch(self, ids) -> dict:
+        self._compact()
+        vectors = {}
+        for id in ids:
+            row = self._row_of(id)
+            if row is not None:
+                vectors[id] = {'id': id, 'values': self.matrix[row].tolist(), 'metadata': self._metadata(id)}
+        return {'vectors': vectors}
+
+    def upsert(self, vectors) -> None:
+        for id, values, metadata in vectors:
+            if self.dim is None:
+                self.dim = len(values)
+                self.matrix = self.matrix.reshape(0, self.dim)
+            self.deleted.discard(id)
+            self.pending[id] = (values, metadata)
+            self.overlay[id] = metadata
+
+    def delete(self, ids) -> None:
+        for id in ids:
+            self.pending.pop(id, None)
+            self.deleted.add(id)
+
+    def flush(self) -> None:
+        self._compact()
+        os.makedirs(self.path, exist_ok=True)
+        matrix = np.ascontiguousarray(self.matrix, dtype=np.float32)
+        ids = [ str(id) for id in self.ids ]
+        write_chunk_store(self.path, ((id, self._metadata(id)) for id in ids))
+        matrix.tofile(os.path.join(self.path, 'vectors.f32.tmp'))
+        with open(os.path.join(self.path, 'ids.npy.tmp'), 'wb') as f:
+            np.save(f, np.array(ids, dtype=str))
+        with open(os.path.join(self.path, 'index.json.tmp'), 'w') as f:
+            json.dump({'count': len(ids), 'dim': self.dim}, f)
+        for name in ('vectors.f32', 'ids.npy', 'index.json'):
+            os.replace(os.path.join(self.path, name + '.tmp'), os.path.join(self.path, name))
+        self._load()
+
+def get_backend(name: str = None) -> VectorBackend:
+    """Backend selected by `name` or the VECTOR_BACKEND env var ('pinecone' or 'local')"""
+    name = name or os.environ.get('VECTOR_BACKEND', 'pinecone')
+    if name == 'local':
+        return LocalIndex(os.environ.get('LOCAL_INDEX_PATH', LOCAL_INDEX_PATH))
+    if name == 'pinecone':
+        import pinecone
+        pinecone.init(
+            api_key=os.environ.get('PINECONE_API_KEY'),
+            environment=os.environ.get('PINECONE_ENV')
+        )
+        return PineconeBackend(pinecone.Index(os.environ.get('PINECONE_INDEX', PINECONE_INDEX_NAME)))
+    raise ValueError(f"Unknown vector backend: {name}")
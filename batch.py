@@ -0,0 +1,213 @@
+# Purpose: answer a file of questions ahead of time, to warm caches and review answers
+# Usage: python batch.py questions.jsonl [--profiles profiles.jsonl] [--output batch_output] [--workers 8]
+#
+# questions.jsonl has one {"question": ...} per line; a line may carry its own "who"
+# and "language", or a list of them as "profiles". Other lines are answered once per
+# profile in --profiles (lines of {"who", "language"}), or with the app's default.
+# Every (question, who, language) goes through service.get_response and
+# get_response_audio, as in the app, on a bounded pool of workers. Answers are spoken
+# sentence by sentence as the app speaks them (streaming.speak_stream), so the TTS
+# cache is warmed with the segments a live turn asks for. Retrieval depends on the
+# question alone and runs once per distinct question. Rows are written as
+# Parquet part files in the output directory as they complete, so an interrupted run
+# picks up where it stopped: rows already in the directory are skipped. Read the
+# results with pyarrow.parquet.read_table(output).
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from hashlib import sha256
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import audio_meta
+import scheduler
+import service
+from orchestrator import StageFailed
+from streaming import speak_stream
+from tracing import default_tracer
+
+OUTPUT_PATH = './batch_output'
+FLUSH_EVERY = 50
+DEFAULT_PROFILE = {
+    'who': "My name is Ian. I'm a farmer from Iowa. I'm pro-gun, pro-abortion, and worried about the economy.",
+    'language': 'English',
+}
+# per-stage seconds of each row, from the orchestrator's timings plus tts
+STAGES = ('lexical', 'embed', 'query', 'neighbors', 'completion', 'tts', 'total')
+
+SCHEMA = pa.schema([
+    ('key', pa.string()),
+    ('question', pa.string()),
+    ('who', pa.string()),
+    ('language', pa.string()),
+    ('text', pa.string()),
+    # every retrieved quote (vectorize.get_citations), and the numbers the answer cites
+    ('citations', pa.list_(pa.struct([('number', pa.int32()), ('url', pa.string())]))),
+    ('cited', pa.list_(pa.int32())),
+    ('audio', pa.binary()),
+    ('audio_seconds', pa.float64()),
+    # the retrieval was run for another profile of the same question
+    ('retrieval_shared', pa.bool_()),
+] + [ (f'{stage}_seconds', pa.float64()) for stage in STAGES ])
+
+def job_key(question: str, who: str, language: str) -> str:
+    return sha256(json.dumps([question, who, language]).encode()).hexdigest()
+
+def read_jobs(path: str, profiles=None) -> list:
+    "(key, question, who, language) for every question and profile, without duplicates"
+    profiles = profiles or [DEFAULT_PROFILE]
+    jobs = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if 'profiles' in item:
+                line_profiles = item['profiles']
+            elif 'who' in item or 'language' in item:
+                line_profiles = [{**DEFAULT_PROFILE, **item}]
+            else:
+                line_profiles = profiles
+            for profile in line_profiles:
+                who, language = profile.get('who', DEFAULT_PROFILE['who']), profile.get('language', DEFAULT_PROFILE['language'])
+                key = job_key(item['question'], who, language)
+                jobs.setdefault(key, (key, item['question'], who, language))
+    return list(jobs.values())
+
+def read_profiles(path: str) -> list:
+    with open(path) as f:
+        return [ json.loads(line) for line in f if line.strip() ]
+
+def part_paths(output: str) -> list:
+    "The finished part files in the output directory, leaving out a temp file a crash left behind"
+    if not os.path.isdir(output):
+        return []
+    return sorted(os.path.join(output, name) for name in os.listdir(output)
+                  if name.endswith('.parquet') and not name.startswith('.'))
+
+def done_keys(output: str) -> set:
+    "Keys of the rows already written to the output directory"
+    paths = part_paths(output)
+    if not paths:
+        return set()
+    return set(pq.read_table(paths, columns=['key']).column('key').to_pylist())
+
+class Retrievals:
+    "Runs retrieval once per distinct question; later callers wait for the first"
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.runs = 0
+
+    def get(self, question: str):
+        "(context matrix, retrieval timings, whether another job ran it)"
+        with self.lock:
+            future = self.futures.get(question)
+            shared = future is not None
+            if not shared:
+                future = self.futures[question] = Future()
+                self.runs += 1
+        if not shared:
+            timings = {}
+            try:
+                future.set_result((service.retrieve(question, timings), timings))
+            except Exception as error:
+                future.set_exception(error)
+        matrix, timings = future.result()
+        return matrix, timings, shared
+
+def answer(job, retrievals: Retrievals) -> dict:
+    "One row of output for a (key, question, who, language) job"
+    key, question, who, language = job
+    start = time.perf_counter()
+    matrix, retrieval_timings, shared = retrievals.get(question)
+    timings = dict(retrieval_timings)
+    history = [{'role': 'user', 'content': question}]
+    text, citations, timings = service.get_response(question, history, who, language, timings=timings, matrix=matrix)
+    tts_start = time.perf_counter()
+    # the segments answer_events synthesizes, concatenated into one MP3 stream
+    audio = b''.join(event[2] for event in speak_stream(
+        iter([text]), lambda sentence: service.get_response_audio(sentence, strip=True)
+    ) if event[0] == 'audio')
+    timings['tts'] = time.perf_counter() - tts_start
+    # wall time of the row, including waiting for a shared retrieval
+    timings['total'] = time.perf_counter() - start
+    return {
+        'key': key, 'question': question, 'who': who, 'language': language, 'text': text,
+        'citations': [ {'number': number, 'url': url} for number, url in citations ],
+        'cited': sorted(set(service.extract_reference_numbers(text))),
+        'audio': audio, 'audio_seconds': audio_meta.duration(audio), 'retrieval_shared': shared,
+        **{ f'{stage}_seconds': timings.get(stage) for stage in STAGES },
+    }
+
+def write_part(output: str, rows: list) -> None:
+    "Rows as a new part file, written atomically so a crash never leaves half a part"
+    os.makedirs(output, exist_ok=True)
+    name = f'part-{len(part_paths(output)):05d}.parquet'
+    # hidden until complete, so readers of the directory (done_keys, read_table) skip it
+    temp = os.path.join(output, f'.{name}.tmp')
+    pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), temp, compression='zstd')
+    os.replace(temp, os.path.join(output, name))
+
+def run_batch(jobs, output: str = OUTPUT_PATH, workers: int = 8, flush_every: int = FLUSH_EVERY) -> dict:
+    "Answers the jobs not yet in `output`; returns counts and throughput"
+    done = done_keys(output)
+    todo = [ job for job in jobs if job[0] not in done ]
+    retrievals = Retrievals()
+    rows, written, failed = [], 0, {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [ pool.submit(answer, job, retrievals) for job in todo ]
+        try:
+            for future in as_completed(futures):
+                try:
+                    rows.append(future.result())
+                except Exception as error:
+                    # left out of the output, so the next run retries it
+                    stage = error.stage if isinstance(error, StageFailed) else type(error).__name__
+                    failed[stage] = failed.get(stage, 0) + 1
+                    continue
+                if len(rows) >= flush_every:
+                    write_part(output, rows)
+                    written += len(rows)
+                    rows = []
+        finally:
+            # on an interrupt, keep what is answered and drop what hasn't started
+            for future in futures:
+                future.cancel()
+            if rows:
+                write_part(output, rows)
+                written += len(rows)
+    elapsed = time.perf_counter() - start
+    return {
+        'jobs': len(jobs), 'skipped': len(done & { job[0] for job in jobs }), 'answered': written,
+        'failed': failed, 'retrievals': retrievals.runs, 'seconds': elapsed,
+        'answers_per_second': written / elapsed if elapsed else 0.0,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer a file of questions for several profiles ahead of time')
+    parser.add_argument('questions', help='.jsonl file of {"question"} lines')
+    parser.add_argument('--profiles', help='.jsonl file of {"who", "language"} lines to answer every question for')
+    parser.add_argument('--output', default=OUTPUT_PATH, help='directory of Parquet part files')
+    parser.add_argument('--workers', type=int, default=8, help='questions answered at once')
+    parser.add_argument('--flush-every', type=int, default=FLUSH_EVERY, help='rows per part file')
+    args = parser.parse_args()
+
+    # a batch yields to interactive turns sharing this process's scheduler
+    scheduler.default_scheduler().default_priority = scheduler.BACKGROUND
+    jobs = read_jobs(args.questions, read_profiles(args.profiles) if args.profiles else None)
+    report = run_batch(jobs, args.output, args.workers, args.flush_every)
+
+    print(f"Answered {report['answered']} of {report['jobs']} ({report['skipped']} already done) "
+          f"in {report['seconds']:.1f} s: {report['answers_per_second']:.2f} answers/s, "
+          f"{report['retrievals']} retrievals")
+    for stage, n in report['failed'].items():
+        print(f'{n} failed at {stage}; rerun to retry them')
+    for stage, stats in default_tracer().snapshot().items():
+        print(f"{stage}: p50 {stats['p50']:.2f} s, p95 {stats['p95']:.2f} s over {stats['count']} spans")
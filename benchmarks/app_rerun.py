@@ -0,0 +1,39 @@
+# Purpose: cost of executing app.py's top level, cold (first run) vs. warm (every later rerun)
+# Usage: python -m benchmarks.app_rerun [--reruns 200]
+#
+# Streamlit re-executes app.py on every interaction; this times the part outside the
+# __main__ UI block. The pipeline runs in the answer API (api_server.py), so this is
+# only the thin client's imports and connection pool.
+
+import argparse
+import os
+import runpy
+import tempfile
+import time
+
+def run_app():
+    runpy.run_path('app.py', run_name='app_rerun_benchmark')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reruns', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        os.environ['VECTOR_BACKEND'] = 'local'
+        os.environ['LOCAL_INDEX_PATH'] = path
+
+        start = time.perf_counter()
+        run_app()
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.reruns):
+            run_app()
+        warm = (time.perf_counter() - start) / args.reruns
+
+    print(f'first run : {cold * 1000:8.1f} ms (imports, connection pool)')
+    print(f'rerun     : {warm * 1000:8.2f} ms per interaction over {args.reruns} reruns')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# Purpose: header-parsed durations of the filler clips vs. the old 128 kbps estimate
+# Usage: python -m benchmarks.audio_duration [--repeat 200]
+
+import argparse
+import glob
+import time
+
+import audio_meta
+
+def estimate_128kbps(audio: bytes) -> float:
+    return len(audio) / 128000 * 8
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob('audio/*.wav'), key=lambda p: int(p.split('/')[-1].split('.')[0]))
+    clips = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            clips.append((path, f.read()))
+
+    for path, audio in clips:
+        print(f'{path:14s} {audio_meta.audio_format(audio):4s} {audio_meta.duration(audio):7.3f} s '
+              f'(128 kbps guess {estimate_128kbps(audio):7.3f} s)')
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for _, audio in clips:
+            audio_meta.duration(audio)
+    per_call = (time.perf_counter() - start) / (args.repeat * len(clips))
+    print(f'duration(): {per_call * 1e6:.1f} us per clip over {len(clips)} clips')
+
+if __name__ == '__main__':
+    main()
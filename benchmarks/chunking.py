@@ -0,0 +1,82 @@
+# Purpose: re-chunking a synthetic corpus: the old per-line loop vs. chunking.window_bounds
+# Usage: python -m benchmarks.chunking [--videos 500] [--minutes 60]
+
+import argparse
+import random
+import time
+
+from chunking import window_bounds, line_tokens
+from node import YTVideo, YTVideoChunk, NULL_ID
+
+WORDS = 'the economy america energy china ukraine ethanol border family farm tax policy freedom'.split()
+
+def synthetic_transcripts(videos, minutes, seed=0):
+    rng = random.Random(seed)
+    corpus = {}
+    for v in range(videos):
+        lines, start = [], rng.uniform(0, 2)
+        while start < minutes * 60:
+            duration = rng.uniform(1.5, 6)
+            lines.append({'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 14))),
+                          'start': round(start, 2), 'duration': round(duration, 2)})
+            start += duration
+        corpus[f'video{v:05d}'] = lines
+    return corpus
+
+def legacy_chunks(video_id, transcript, window=30):
+    "The previous per-line loop of YTVideo.__init__; returns (chunks, dropped lines)"
+    chunks, lines, end_time = [], [], window
+    for i, line in enumerate(transcript):
+        if line['start'] > end_time:
+            chunk = YTVideoChunk(video_id, ' '.join(lines), int(transcript[i-len(lines)]['start']),
+                                 prev=chunks[-1].id if chunks else NULL_ID)
+            if chunks:
+                chunks[-1].next = chunk.id
+            chunks.append(chunk)
+            end_time = line['start'] + window
+            lines = []
+        lines.append(line['text'])
+    # trailing lines were only kept when the video had no chunk at all
+    if not chunks:
+        return [YTVideoChunk(video_id, ' '.join(lines))], 0
+    return chunks, len(lines)
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', type=int, default=500)
+    parser.add_argument('--minutes', type=float, default=60)
+    args = parser.parse_args()
+
+    corpus = synthetic_transcripts(args.videos, args.minutes)
+    print(f'{args.videos} videos, {sum(map(len, corpus.values()))} transcript lines')
+
+    results, elapsed = timed(lambda: [ legacy_chunks(v, t) for v, t in corpus.items() ])
+    print(f'old loop, 30 s                  : {elapsed:6.2f} s, {sum(len(c) for c, _ in results)} chunks, '
+          f'{sum(d for _, d in results)} trailing lines dropped')
+
+    # full re-chunk: boundaries, text, ids and prev/next links
+    for label, kwargs in [
+        ('30 s', {}),
+        ('30 s, 25% overlap', {'overlap': 0.25}),
+        ('60 s, 50% overlap', {'window': 60, 'overlap': 0.5}),
+        ('256 tokens', {'max_tokens': 256}),
+        ('256 tokens, 25% overlap', {'max_tokens': 256, 'overlap': 0.25}),
+    ]:
+        videos, elapsed = timed(lambda: [ YTVideo(v, t, 'title', '2023-01-01', **kwargs) for v, t in corpus.items() ])
+        print(f'YTVideo, {label:23s}: {elapsed:6.2f} s, {sum(len(v.chunks) for v in videos)} chunks')
+
+    # boundaries alone, from the start-time / token arrays
+    starts = [ [ line['start'] for line in t ] for t in corpus.values() ]
+    tokens = [ line_tokens([ line['text'] for line in t ]) for t in corpus.values() ]
+    _, elapsed = timed(lambda: [ window_bounds(s, overlap=0.25) for s in starts ])
+    print(f'window_bounds, 30 s, 25% overlap: {elapsed:6.2f} s')
+    _, elapsed = timed(lambda: [ window_bounds(s, tokens=t, max_tokens=256) for s, t in zip(starts, tokens) ])
+    print(f'window_bounds, 256 tokens       : {elapsed:6.2f} s')
+
+if __name__ == '__main__':
+    main()
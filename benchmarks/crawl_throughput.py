@@ -0,0 +1,61 @@
+# Purpose: transcript crawl throughput, serial vs. the pooled, rate-limited crawler, and resume
+# Usage: python -m benchmarks.crawl_throughput [--videos 200] [--latency 0.3] [--workers 8]
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.fakes import FakeTranscriptServer
+from crawler import Checkpoint, crawl_transcripts
+
+def transcript_fetcher(base_url):
+    def fetch(video_id):
+        with urllib.request.urlopen(f'{base_url}/transcripts/{video_id}') as response:
+            return json.loads(response.read())
+    return fetch
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', type=int, default=200)
+    parser.add_argument('--serial-videos', type=int, default=20, help='serial baseline is slow; extrapolated')
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds per transcript request')
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-second', type=float, default=50.0)
+    args = parser.parse_args()
+
+    video_ids = [ f'video{i:05d}' for i in range(args.videos) ]
+    with FakeTranscriptServer(args.latency) as server, tempfile.TemporaryDirectory() as path:
+        fetch = transcript_fetcher(server.url)
+
+        start = time.perf_counter()
+        for video_id in video_ids[:args.serial_videos]:
+            fetch(video_id)
+        serial = args.serial_videos / (time.perf_counter() - start)
+        print(f'serial          : {serial:7.1f} videos/s (~{args.videos / serial:.0f} s for {args.videos})')
+
+        server.failure_rate = args.failure_rate
+        checkpoint = Checkpoint(os.path.join(path, 'checkpoint.jsonl'))
+        half = video_ids[:args.videos // 2]
+        start = time.perf_counter()
+        transcripts, failed = crawl_transcripts(half, checkpoint, fetch=fetch, workers=args.workers,
+                                                per_second=args.per_second)
+        elapsed = time.perf_counter() - start
+        print(f'pooled          : {len(transcripts) / elapsed:7.1f} videos/s '
+              f'({args.workers} workers, {args.per_second:.0f}/s limit, {len(failed)} failed)')
+
+        # a new run over all videos picks up the first half from the checkpoint
+        requests_before = server.requests
+        checkpoint = Checkpoint(checkpoint.path)
+        start = time.perf_counter()
+        transcripts, failed = crawl_transcripts(video_ids, checkpoint, fetch=fetch, workers=args.workers,
+                                                per_second=args.per_second)
+        elapsed = time.perf_counter() - start
+        print(f'resumed         : {len(transcripts)} transcripts in {elapsed:.1f} s, '
+              f'{server.requests - requests_before} requests for {args.videos - len(half)} new videos')
+
+if __name__ == '__main__':
+    main()
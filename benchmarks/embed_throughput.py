@@ -0,0 +1,78 @@
+# Purpose: compare per-chunk get_embedding against the batched pipeline on a fake endpoint
+# Usage: python -m benchmarks.embed_throughput [--chunks 2000] [--latency 0.2]
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import openai
+
+from benchmarks.fakes import FakeOpenAIServer
+from embed_cache import EmbeddingCache
+from embeddings import embed_texts
+from vectorize import get_embedding
+
+WORDS = 'the economy america energy china ukraine ethanol border family farm tax policy freedom'.split()
+
+def synthetic_chunks(n, words_per_chunk=80, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(words_per_chunk)) + f' #{i}' for i in range(n)]
+
+def run_serial(texts):
+    return [get_embedding(t) for t in texts]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--serial-chunks', type=int, default=100, help='serial baseline is slow; extrapolated')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per request')
+    parser.add_argument('--per-item-latency', type=float, default=0.0005)
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--batch-tokens', type=int, default=60000)
+    args = parser.parse_args()
+
+    # measure raw API throughput; the cache is exercised explicitly below
+    os.environ['EMBEDDING_CACHE_PATH'] = ''
+    texts = synthetic_chunks(args.chunks)
+    with FakeOpenAIServer(args.latency, args.per_item_latency, args.failure_rate) as server:
+        openai.api_key = 'fake'
+        openai.api_base = server.url
+
+        serial_texts = texts[:args.serial_chunks]
+        server.failure_rate = 0.0
+        start = time.perf_counter()
+        run_serial(serial_texts)
+        serial = len(serial_texts) / (time.perf_counter() - start)
+
+        server.failure_rate = args.failure_rate
+        requests_before = server.requests
+        start = time.perf_counter()
+        embeds = embed_texts(texts, concurrency=args.concurrency, max_batch_tokens=args.batch_tokens)
+        elapsed = time.perf_counter() - start
+        assert all(e is not None for e in embeds)
+        batched = len(texts) / elapsed
+        batched_requests = server.requests - requests_before
+
+        # re-index: first pass fills the cache, second pass should not hit the endpoint
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(os.path.join(tmp, 'cache.bin'))
+            embed_texts(texts, concurrency=args.concurrency, max_batch_tokens=args.batch_tokens, cache=cache)
+            requests_before = server.requests
+            cache.hits = cache.misses = 0
+            start = time.perf_counter()
+            embed_texts(texts, cache=cache)
+            cached = len(texts) / (time.perf_counter() - start)
+            cached_requests = server.requests - requests_before
+            cache_stats = cache.stats()
+
+    print(f'serial   : {serial:10.1f} chunks/s ({len(serial_texts)} chunks)')
+    print(f'batched  : {batched:10.1f} chunks/s ({len(texts)} chunks, '
+          f'{batched_requests} requests incl. retries, {elapsed:.2f}s)')
+    print(f'speedup  : {batched / serial:10.1f}x')
+    print(f'cached   : {cached:10.1f} chunks/s ({cached_requests} requests, '
+          f"hit rate {cache_stats['hit_rate']:.0%})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+# Purpose: offline end-to-end benchmark: ingestion, retrieval and answering against local stand-ins
+# Usage: python -m benchmarks.end_to_end [--videos 100] [--questions 40] [--concurrency 4]
+#                                        [--output benchmarks/results/end_to_end.json] [--baseline FILE]
+#
+# OpenAI (embeddings, chat completions) and ElevenLabs run as local HTTP fakes and
+# Pinecone as an in-process fake index (benchmarks/fakes.py), all with configurable
+# latency and failure injection, over a synthetic corpus of YTVideo chunks. Each
+# phase reports throughput, latency percentiles, errors, per-stage percentiles from
+# the tracer (tracing.py) and peak RSS. Results are written as sorted JSON to a
+# fixed path; --baseline prints the change against an earlier results file.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource as rusage
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.chunking import synthetic_transcripts, WORDS
+from benchmarks.fakes import FakeOpenAIServer, FakeElevenLabsServer, FakePineconeIndex
+
+RESULTS_PATH = 'benchmarks/results/end_to_end.json'
+# metrics compared against --baseline, and whether higher is better
+COMPARED = {'per_second': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False, 'first_audio_p50_ms': False}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentiles(latencies) -> dict:
+    if not latencies:
+        return {'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3)}
+
+def questions(n, seed=0):
+    rng = random.Random(seed)
+    return [ f"what do you think about {' and '.join(rng.sample(WORDS, 2))} #{i}?" for i in range(n) ]
+
+class Phase:
+    "Times calls of one phase and collects its results; the tracer is reset at the start"
+    def __init__(self, name, results) -> None:
+        from tracing import default_tracer
+        self.name = name
+        self.results = results
+        self.latencies = []
+        self.errors = 0
+        self.items = 0
+        self.extra = {}
+        self.tracer = default_tracer()
+
+    def __enter__(self):
+        self.tracer.reset()
+        self.start = time.perf_counter()
+        return self
+
+    def call(self, fn, *args, items=1):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.errors += 1
+            return None
+        self.latencies.append(time.perf_counter() - start)
+        self.items += items
+        return result
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stages = { stage: {'count': stats['count'], 'errors': stats['errors'],
+                           **{ f'{p}_ms': round(stats[p] * 1000, 3) for p in ('p50', 'p95', 'p99') }}
+                   for stage, stats in self.tracer.snapshot().items() }
+        self.results[self.name] = {
+            'items': self.items, 'errors': self.errors, 'seconds': round(elapsed, 3),
+            'per_second': round(self.items / elapsed, 3) if elapsed else 0.0,
+            **percentiles(self.latencies), 'peak_rss_mb': round(peak_rss_mb(), 1), 'stages': stages, **self.extra,
+        }
+        result = self.results[self.name]
+        print(f"{self.name:22s}: {result['per_second']:9.1f}/s  p50 {result['p50_ms']:9.2f} ms  "
+              f"p95 {result['p95_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+              f"{self.errors} errors  peak RSS {result['peak_rss_mb']:.0f} MiB")
+        return False
+
+def run_answers(prompts, who, language, concurrency, phase):
+    "Full turns through service.answer_events, `concurrency` at a time"
+    from service import answer_events
+    first_audio = []
+
+    async def turn(prompt, limit):
+        async with limit:
+            start = time.perf_counter()
+            done = False
+            async for event, data in answer_events(prompt, [{'role': 'user', 'content': prompt}], who, language):
+                if event == 'audio' and data['index'] == 0:
+                    first_audio.append(time.perf_counter() - start)
+                done = done or event == 'done'
+            if done:
+                phase.latencies.append(time.perf_counter() - start)
+                phase.items += 1
+            else:
+                phase.errors += 1
+
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(turn(prompt, limit) for prompt in prompts))
+    asyncio.run(run())
+    phase.extra['first_audio_p50_ms'] = percentiles(first_audio)['p50_ms']
+    phase.extra['first_audio_p95_ms'] = percentiles(first_audio)['p95_ms']
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    print(f'\nchange against {baseline_path}:')
+    for phase, result in results.items():
+        if phase not in baseline:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED.items():
+            before, after = baseline[phase].get(metric), result.get(metric)
+            if before and after is not None:
+                change = (after - before) / before
+                worse = change < 0 if higher_is_better else change > 0
+                changes.append(f"{metric} {change:+.0%}{' (worse)' if worse and abs(change) > 0.1 else ''}")
+        print(f"{phase:22s}: {', '.join(changes)}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', type=int, default=100)
+    parser.add_argument('--minutes', type=float, default=20, help='length of each synthetic video')
+    parser.add_argument('--questions', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--openai-latency', type=float, default=0.1, help='seconds per request / to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--index-latency', type=float, default=0.03)
+    parser.add_argument('--tts-latency', type=float, default=0.2)
+    parser.add_argument('--tts-chars-per-second', type=float, default=2000.0)
+    parser.add_argument('--failure-rate', type=float, default=0.02,
+                        help='429s / index errors injected into the question phases (retried by the orchestrator)')
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, \
+         FakeOpenAIServer(args.openai_latency, tokens_per_second=args.tokens_per_second) as openai_server, \
+         FakeElevenLabsServer(args.tts_latency, args.tts_chars_per_second) as tts_server:
+        # everything the app would persist goes to a scratch directory; no caches between phases
+        os.environ.update({
+            'OPENAI_API_KEY': 'fake', 'ELEVENLABS_API_KEY': 'fake', 'EMBEDDING_CACHE_PATH': '', 'TTS_CACHE_PATH': '',
+            'AUDIO_STORE_PATH': os.path.join(tmp, 'audio_store'), 'AUDIO_SERVER_PORT': str(free_port()),
+            'CHUNK_STORE_PATH': os.path.join(tmp, 'chunk_store'), 'LEXICAL_INDEX_PATH': os.path.join(tmp, 'lexical_index'),
+        })
+        # the elevenlabs package reads its base URL when first imported
+        os.environ['ELEVEN_BASE_URL'] = tts_server.url
+        import openai
+        import resources
+        import vectorize
+        from backends import PineconeBackend
+        from chunk_store import write_chunk_store
+        from embeddings import embed_records, upsert_batches
+        from lexical import write_lexical_index
+        from node import YTVideo
+        import service
+
+        openai.api_base = openai_server.url
+        fake_index = FakePineconeIndex(args.index_latency)
+        index = PineconeBackend(fake_index)
+        resources.vector_index.override(index)
+
+        results = {}
+        corpus = synthetic_transcripts(args.videos, args.minutes)
+        with Phase('chunking', results) as phase:
+            videos = [ phase.call(YTVideo, v, t, 'title', '2023-09-01T00:00:00Z') for v, t in corpus.items() ]
+            records = []
+            for video in filter(None, videos):
+                metadatas = video.get_chunk_metadatas()
+                for md, text in zip(metadatas, video.get_chunk_transcripts()):
+                    md['transcript'] = text
+                records.extend(zip(video.get_chunk_ids(), video.get_chunk_transcripts(), metadatas))
+            phase.extra['chunks'] = len(records)
+
+        with Phase('embed_upsert', results) as phase:
+            phase.call(lambda: upsert_batches(index, embed_records(records)), items=len(records))
+        with Phase('local_indexes', results) as phase:
+            phase.call(write_chunk_store, os.environ['CHUNK_STORE_PATH'],
+                       ((id, md) for id, _, md in records), items=len(records))
+            phase.call(write_lexical_index, os.environ['LEXICAL_INDEX_PATH'],
+                       ((id, text) for id, text, _ in records), items=len(records))
+
+        # question phases run with failures injected; upstream calls are retried there
+        # (not into TTS: a failed segment is not retried and fails the turn)
+        openai_server.failure_rate = fake_index.failure_rate = args.failure_rate
+        prompts = questions(args.questions)
+
+        with Phase('recursive_query', results) as phase:
+            matrices = [ phase.call(vectorize.recursive_query, index, prompt, 5) for prompt in prompts ]
+        matrices = [ mat for mat in matrices if mat is not None ]
+        with Phase('format_context_matrix', results) as phase:
+            for _ in range(20):
+                for mat in matrices:
+                    phase.call(vectorize.format_context_matrix, mat, 2500)
+
+        who, language = 'I am a farmer from Iowa, worried about the economy.', 'English'
+        with Phase('get_response', results) as phase, ThreadPoolExecutor(args.concurrency) as pool:
+            history = lambda prompt: [{'role': 'user', 'content': prompt}]
+            list(pool.map(lambda prompt: phase.call(service.get_response, prompt, history(prompt), who, language), prompts))
+        with Phase('answer', results) as phase:
+            # full turns with streaming and speech, on questions not seen above
+            run_answers(questions(args.questions, seed=1), who, language, args.concurrency, phase)
+
+        results['upstream_requests'] = {'openai': openai_server.requests, 'index': fake_index.requests,
+                                        'elevenlabs': tts_server.requests}
+
+    output = {'config': vars(args), 'results': results}
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1, sort_keys=True)
+    print(f'\nresults written to {args.output}')
+    if args.baseline:
+        compare({ k: v for k, v in results.items() if k != 'upstream_requests' }, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+# Purpose: local stand-ins for paid upstream APIs, for offline benchmarking
+
+import base64
+import json
+import random
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 1536
+ANSWER_WORDS = 100
+# one MPEG1 Layer III frame header: 128 kbps, 44.1 kHz, no padding -> 417-byte frames of 1152 samples
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_BYTES = 417
+MP3_FRAME_SECONDS = 1152 / 44100
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    # deterministic per text so repeated runs produce the same vectors
+    rng = random.Random(text)
+    return [rng.uniform(-1, 1) for _ in range(dim)]
+
+def fake_answer(messages, words: int = ANSWER_WORDS) -> str:
+    "Answer in the app's style, built from the retrieved quotes and citing them like '(2)'"
+    quotes = messages[-1]['content'] if messages else ''
+    numbers = re.findall(r'\((\d+)\)', quotes) or ['1']
+    vocabulary = re.findall(r'[A-Za-z]+', quotes) or ['freedom', 'america']
+    rng = random.Random(quotes)
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentence = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(8, 16)))
+        sentences.append(sentence[0].upper() + sentence[1:] + f' ({rng.choice(numbers)}).')
+    return ' '.join(sentences)
+
+def fake_mp3(seconds: float) -> bytes:
+    "Silent but well-formed MP3 of about `seconds`, so audio_meta can parse it"
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+    return frame * max(1, round(seconds / MP3_FRAME_SECONDS))
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        server.record_request(self.path, body)
+
+        if random.random() < server.failure_rate:
+            time.sleep(server.latency)
+            return self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}})
+
+        if self.path.endswith('/embeddings'):
+            inputs = body.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(server.latency + server.per_item_latency * len(inputs))
+            data = []
+            for i, text in enumerate(inputs):
+                embed = fake_embedding(text, server.dim)
+                if body.get('encoding_format') == 'base64':
+                    embed = base64.b64encode(struct.pack(f'{len(embed)}f', *embed)).decode()
+                data.append({'object': 'embedding', 'index': i, 'embedding': embed})
+            tokens = sum(len(t) // 4 + 1 for t in inputs)
+            return self._send_json(200, {
+                'object': 'list', 'data': data, 'model': body.get('model'),
+                'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+            })
+
+        if self.path.endswith('/chat/completions'):
+            return self._chat_completion(body)
+
+        self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def _chat_completion(self, body):
+        # server.latency is the time to the first token, then tokens_per_second
+        server = self.server
+        words = [ word + ' ' for word in fake_answer(body.get('messages', [])).split(' ') ]
+        time.sleep(server.latency)
+        created = int(time.time())
+        if not body.get('stream'):
+            time.sleep(len(words) / server.tokens_per_second)
+            return self._send_json(200, {
+                'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': created, 'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)},
+                             'finish_reason': 'stop'}],
+            })
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send(data):
+            payload = f'data: {data}\n\n'.encode()
+            self.wfile.write(f'{len(payload):x}\r\n'.encode() + payload + b'\r\n')
+            self.wfile.flush()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(1 / server.tokens_per_second)
+            send(json.dumps({
+                'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': body.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}],
+            }))
+        send('[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Fake OpenAI endpoint on localhost (embeddings and chat completions, streamed or not)
+    with configurable latency and 429 injection.
+
+    with FakeOpenAIServer(latency=0.2) as server:
+        openai.api_base = server.url
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.1, per_item_latency=0.0, failure_rate=0.0, dim=EMBEDDING_DIM,
+                 handler=FakeOpenAIHandler, tokens_per_second=50.0):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.per_item_latency = per_item_latency
+        self.failure_rate = failure_rate
+        self.dim = dim
+        self.requests = 0
+        self.items = 0
+        self.counter_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def record_request(self, path, body):
+        inputs = body.get('input', [])
+        with self.counter_lock:
+            self.requests += 1
+            self.items += 1 if isinstance(inputs, str) else len(inputs)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+def fake_transcript(video_id: str, lines: int = 120) -> list:
+    rng = random.Random(video_id)
+    return [
+        {'text': ' '.join(rng.choice(('freedom', 'economy', 'energy', 'merit', 'america', 'truth'))
+                          for _ in range(8)),
+         'start': i * 4.0, 'duration': 4.0}
+        for i in range(lines)
+    ]
+
+class FakeTranscriptHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        video_id = self.path.rstrip('/').split('/')[-1]
+        server.record_request(self.path, {'input': video_id})
+        time.sleep(server.latency)
+        if random.random() < server.failure_rate:
+            status, body = 429, {'error': 'Too Many Requests'}
+        else:
+            status, body = 200, fake_transcript(video_id)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class FakeTranscriptServer(FakeOpenAIServer):
+    """Stub transcript endpoint: GET /transcripts/<video_id> returns a transcript as JSON.
+
+    with FakeTranscriptServer(latency=0.3) as server:
+        crawl_transcripts(ids, fetch=lambda id: fetch_json(f'{server.url}/transcripts/{id}'))
+    """
+    def __init__(self, latency=0.3, failure_rate=0.0):
+        super().__init__(latency=latency, failure_rate=failure_rate, handler=FakeTranscriptHandler)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class FakeElevenLabsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        text = body.get('text', '')
+        server.record_request(self.path, {'input': text})
+        time.sleep(server.latency + len(text) / server.chars_per_second)
+        if random.random() < server.failure_rate:
+            payload, status, content_type = json.dumps({'detail': {'status': 'too_many_concurrent_requests',
+                                                                   'message': 'Too many requests'}}).encode(), 429, 'application/json'
+        else:
+            # speech runs at about 15 characters per second
+            payload, status, content_type = fake_mp3(len(text) / 15), 200, 'audio/mpeg'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class FakeElevenLabsServer(FakeOpenAIServer):
+    """Stub of the ElevenLabs text-to-speech endpoint: POST /v1/text-to-speech/<voice_id>
+    returns MP3 after latency + len(text) / chars_per_second. The elevenlabs package reads
+    its base URL at import, so set ELEVEN_BASE_URL before it is first imported.
+
+    with FakeElevenLabsServer(latency=0.4) as server:
+        os.environ['ELEVEN_BASE_URL'] = server.url
+    """
+    def __init__(self, latency=0.4, chars_per_second=300.0, failure_rate=0.0):
+        super().__init__(latency=latency, failure_rate=failure_rate, handler=FakeElevenLabsHandler)
+        self.chars_per_second = chars_per_second
+
+class FakeIndexUnavailable(Exception):
+    pass
+
+class FakePineconeIndex:
+    """In-process stand-in for pinecone.Index (query / fetch / upsert / delete with
+    the same keyword arguments and result shapes), with per-call latency and failures.
+    Wrap it in backends.PineconeBackend to run the app's code path unchanged."""
+    def __init__(self, latency=0.05, failure_rate=0.0, dim=EMBEDDING_DIM) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.dim = dim
+        self.ids = []
+        self.rows = {}       # id -> row in vectors
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.metadata = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _call(self):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise FakeIndexUnavailable('(503) Service Unavailable')
+
+    def upsert(self, vectors, namespace=None):
+        self._call()
+        with self.lock:
+            new = []
+            for id, values, metadata in vectors:
+                row = self.rows.get(id)
+                if row is None:
+                    # rows of new ids follow the stored ones, in the order they arrive
+                    self.rows[id] = len(self.ids)
+                    self.ids.append(id)
+                    new.append(values)
+                elif row < len(self.vectors):
+                    self.vectors[row] = values
+                else:
+                    # repeated within this batch
+                    new[row - len(self.vectors)] = values
+                self.metadata[id] = metadata
+            if new:
+                self.vectors = np.vstack([self.vectors, np.asarray(new, dtype=np.float32)])
+        return {'upserted_count': len(vectors)}
+
+    def query(self, vector, top_k=10, include_metadata=False, include_values=False, namespace=None):
+        self._call()
+        with self.lock:
+            ids, vectors = list(self.ids), self.vectors
+        scores = vectors @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:top_k]
+        return {'matches': [
+            {'id': ids[i], 'score': float(scores[i]),
+             **({'metadata': self.metadata[ids[i]]} if include_metadata else {}),
+             **({'values': vectors[i].tolist()} if include_values else {})}
+            for i in top
+        ]}
+
+    def fetch(self, ids, namespace=None):
+        self._call()
+        with self.lock:
+            return {'vectors': {
+                id: {'id': id, 'values': self.vectors[self.rows[id]].tolist(), 'metadata': self.metadata[id]}
+                for id in ids if id in self.rows
+            }}
+
+    def delete(self, ids, namespace=None):
+        self._call()
+        with self.lock:
+            removed = set(ids)
+            keep = [ id for id in self.ids if id not in removed ]
+            self.vectors = self.vectors[[ self.rows[id] for id in keep ]] if keep else self.vectors[:0]
+            self.ids = keep
+            self.rows = { id: i for i, id in enumerate(keep) }
+            for id in ids:
+                self.metadata.pop(id, None)
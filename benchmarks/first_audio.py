@@ -0,0 +1,55 @@
+# Purpose: time-to-first-audio of full completion + full TTS vs. sentence-level streaming
+# Usage: python -m benchmarks.first_audio [--tokens-per-second 30] [--tts-chars-per-second 300]
+
+import argparse
+import time
+
+from streaming import speak_stream
+
+ANSWER = (
+    "Look, I grew up in Ohio and I've seen what happens when Washington forgets the heartland (1). "
+    "Farmers like you are getting squeezed by inflation that was manufactured in DC (2). "
+    "We need to unleash American energy, frack, drill, burn coal, and embrace nuclear (3)(4). "
+    "That brings down input costs for every farm in Iowa. "
+    "And I will always defend your Second Amendment rights, no ifs, ands or buts (5)."
+)
+
+def fake_deltas(text, tokens_per_second):
+    for word in text.split(' '):
+        time.sleep(1 / tokens_per_second)
+        yield word + ' '
+
+def fake_tts(text, first_byte_latency, chars_per_second):
+    time.sleep(first_byte_latency + len(text) / chars_per_second)
+    return text.encode()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--first-token-latency', type=float, default=1.0)
+    parser.add_argument('--tokens-per-second', type=float, default=30)
+    parser.add_argument('--tts-latency', type=float, default=0.4)
+    parser.add_argument('--tts-chars-per-second', type=float, default=300)
+    args = parser.parse_args()
+
+    def tts(text):
+        return fake_tts(text, args.tts_latency, args.tts_chars_per_second)
+
+    start = time.perf_counter()
+    time.sleep(args.first_token_latency)
+    full_text = ''.join(fake_deltas(ANSWER, args.tokens_per_second))
+    tts(full_text)
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    time.sleep(args.first_token_latency)
+    first_audio = None
+    for event in speak_stream(fake_deltas(ANSWER, args.tokens_per_second), tts):
+        if event[0] == 'audio' and first_audio is None:
+            first_audio = time.perf_counter() - start
+    streamed_total = time.perf_counter() - start
+
+    print(f'full LLM + full TTS : first audio after {serial:.2f} s')
+    print(f'sentence streaming  : first audio after {first_audio:.2f} s (all audio after {streamed_total:.2f} s)')
+
+if __name__ == '__main__':
+    main()
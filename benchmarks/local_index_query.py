@@ -0,0 +1,44 @@
+# Purpose: top-K query latency of the in-process LocalIndex on a synthetic corpus
+# Usage: python -m benchmarks.local_index_query [--vectors 50000] [--dim 1536]
+
+import argparse
+import hashlib
+import tempfile
+import time
+import numpy as np
+
+from backends import LocalIndex
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as path:
+        index = LocalIndex(path)
+        vectors = rng.standard_normal((args.vectors, args.dim), dtype=np.float32)
+        ids = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(args.vectors)]
+        start = time.perf_counter()
+        index.upsert((id, vec, {'video_id': 'v', 'timestamp': i, 'prev': '\0', 'next': '\0', 'transcript': ''})
+                     for i, (id, vec) in enumerate(zip(ids, vectors)))
+        index.flush()
+        print(f'build    : {time.perf_counter() - start:8.2f} s for {args.vectors} x {args.dim}')
+
+        start = time.perf_counter()
+        index = LocalIndex(path)
+        print(f'open     : {(time.perf_counter() - start) * 1000:8.2f} ms (memory-mapped)')
+
+        latencies = []
+        for q in rng.standard_normal((args.queries, args.dim), dtype=np.float32):
+            start = time.perf_counter()
+            index.query(q, top_k=args.top_k)
+            latencies.append(time.perf_counter() - start)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(f'query    : p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms (top_k={args.top_k})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Purpose: memory held by chat histories with raw audio bytes vs. blob store handles
+# Usage: python -m benchmarks.session_memory [--sessions 50] [--turns 20] [--distinct 200]
+#
+# Simulates N sessions of M turns each. Answers are drawn from a pool of distinct
+# audio clips, so popular answers repeat across sessions as they do in the app.
+
+import argparse
+import glob
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from blob_store import BlobStore
+
+def make_answers(distinct: int, clips_per_answer: int) -> list:
+    "Distinct, valid MP3 answers built from the filler clips"
+    clips = []
+    for path in sorted(glob.glob('audio/*.wav')):
+        with open(path, 'rb') as f:
+            clips.append(f.read())
+    rng = random.Random(0)
+    return [ b''.join(rng.choice(clips) for _ in range(clips_per_answer)) + os.urandom(16)
+             for _ in range(distinct) ]
+
+def build_sessions(answers, sessions, turns, keep):
+    rng = random.Random(1)
+    history = []
+    for _ in range(sessions):
+        messages = []
+        for turn in range(turns):
+            # every session synthesizes (or reads from the TTS cache) its own copy of the bytes
+            audio = bytes(bytearray(rng.choice(answers)))
+            messages.append({'role': 'user', 'content': f'question {turn}'})
+            messages.append({'role': 'assistant', 'content': 'answer', 'citations': [], 'audio': keep(audio)})
+        history.append(messages)
+    return history
+
+def measure(answers, sessions, turns, keep):
+    tracemalloc.start()
+    start = time.perf_counter()
+    history = build_sessions(answers, sessions, turns, keep)
+    elapsed = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del history
+    return held, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--distinct', type=int, default=200, help='distinct answers across all sessions')
+    parser.add_argument('--clips-per-answer', type=int, default=6)
+    args = parser.parse_args()
+
+    answers = make_answers(args.distinct, args.clips_per_answer)
+    mean_size = sum(map(len, answers)) / len(answers)
+    print(f'{args.sessions} sessions x {args.turns} turns, {args.distinct} distinct answers '
+          f'of {mean_size / 1024:.0f} KiB on average')
+
+    held, elapsed = measure(answers, args.sessions, args.turns, lambda audio: audio)
+    print(f'raw bytes    : {held / 2**20:8.1f} MiB held in session state ({elapsed * 1000:.0f} ms)')
+
+    with tempfile.TemporaryDirectory() as path:
+        store = BlobStore(path)
+        held, elapsed = measure(answers, args.sessions, args.turns, store.put)
+        store.evict()
+        print(f'blob handles : {held / 2**20:8.1f} MiB held in session state ({elapsed * 1000:.0f} ms), '
+              f'{store.nbytes / 2**20:.1f} MiB on disk after dedupe')
+
+if __name__ == '__main__':
+    main()
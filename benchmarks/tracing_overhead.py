@@ -0,0 +1,44 @@
+# Purpose: cost of recording a span (tracing.py), in memory only and with the JSONL export, and of reading the metrics
+# Usage: python -m benchmarks.tracing_overhead [--spans 200000]
+
+import argparse
+import os
+import tempfile
+import time
+
+from tracing import Tracer
+
+STAGES = ['lexical', 'embed', 'query', 'neighbors', 'context', 'completion', 'stream', 'tts', 'turn']
+
+def per_span(tracer, n):
+    start = time.perf_counter()
+    for i in range(n):
+        with tracer.span(STAGES[i % len(STAGES)], tokens=120, bytes=4096) as span:
+            span.set(matches=5)
+    return (time.perf_counter() - start) / n
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spans', type=int, default=200000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for i in range(args.spans):
+        pass
+    loop = (time.perf_counter() - start) / args.spans
+
+    tracer = Tracer()
+    print(f'span, in memory      : {(per_span(tracer, args.spans) - loop) * 1e6:6.2f} us')
+    with tempfile.TemporaryDirectory() as path:
+        jsonl = Tracer(os.path.join(path, 'spans.jsonl'))
+        print(f'span, JSONL export   : {(per_span(jsonl, args.spans) - loop) * 1e6:6.2f} us')
+        jsonl.flush()
+        print(f'JSONL size           : {os.path.getsize(jsonl.path) / args.spans:6.1f} bytes per span')
+
+    start = time.perf_counter()
+    text = tracer.prometheus()
+    print(f'/metrics render      : {(time.perf_counter() - start) * 1000:6.2f} ms '
+          f'({len(STAGES)} stages x {tracer.window} latencies, {len(text)} bytes)')
+
+if __name__ == '__main__':
+    main()
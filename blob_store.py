@@ -0,0 +1,131 @@
+# Purpose: content-addressed on-disk store for audio blobs
+#
+# Blobs live at <path>/<key[:2]>/<key> where key is the sha256 of the bytes, so
+# identical audio is stored once and a key always refers to the same content.
+# Callers keep a BlobHandle (key, size, format) instead of the bytes; the bytes are
+# only read when the audio is actually played. Blobs not accessed for max_age
+# seconds are evicted, then the least recently used ones while over max_bytes.
+
+import os
+import re
+import threading
+import time
+from hashlib import sha256
+
+import audio_meta
+
+BLOB_STORE_PATH = './audio_store'
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+MAX_BYTES = 2 * 1024 * 1024 * 1024
+MAX_AGE = 7 * 24 * 60 * 60
+EVICT_INTERVAL = 5 * 60
+
+def blob_key(data: bytes) -> str:
+    return sha256(data).hexdigest()
+
+class BlobHandle:
+    __slots__ = ('key', 'size', 'format')
+
+    def __init__(self, key: str, size: int, format: str = None) -> None:
+        self.key = key
+        self.size = size
+        self.format = format
+
+    def __repr__(self) -> str:
+        return f'BlobHandle({self.key[:12]}…, {self.size} bytes)'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BlobHandle) and other.key == self.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+class BlobStore:
+    def __init__(self, path: str = BLOB_STORE_PATH, max_bytes: int = MAX_BYTES,
+                 max_age: float = MAX_AGE) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.nbytes = 0
+        self.last_evict = 0.0
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.evict()
+
+    def file(self, key: str) -> str:
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f'Invalid blob key: {key!r}')
+        return os.path.join(self.path, key[:2], key)
+
+    def __contains__(self, key) -> bool:
+        if isinstance(key, BlobHandle):
+            key = key.key
+        return os.path.exists(self.file(key))
+
+    def put(self, data: bytes) -> BlobHandle:
+        "Stores the bytes (once) and returns a handle to them"
+        key = blob_key(data)
+        path = self.file(key)
+        if os.path.exists(path):
+            self.touch(key)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self.lock:
+                self.nbytes += len(data)
+        if self.nbytes > self.max_bytes or time.time() - self.last_evict > EVICT_INTERVAL:
+            self.evict()
+        return BlobHandle(key, len(data), audio_meta.audio_format(data))
+
+    def get(self, key):
+        "Returns the bytes for a key or handle, or None if it was evicted"
+        if isinstance(key, BlobHandle):
+            key = key.key
+        try:
+            with open(self.file(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return data
+
+    def touch(self, key: str) -> None:
+        "Marks the blob as recently used"
+        try:
+            os.utime(self.file(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> int:
+        """Removes expired blobs, then least recently used ones while over max_bytes.
+        Rescans the directory, so blobs written by other processes are accounted for."""
+        with self.lock:
+            now = time.time()
+            blobs = []
+            for root, _, names in os.walk(self.path):
+                for name in names:
+                    if KEY_PATTERN.match(name):
+                        path = os.path.join(root, name)
+                        try:
+                            stat = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        blobs.append((stat.st_mtime, stat.st_size, path))
+            blobs.sort()
+            total = sum(size for _, size, _ in blobs)
+            removed = 0
+            for mtime, size, path in blobs:
+                if now - mtime <= self.max_age and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.nbytes = total
+            self.last_evict = now
+            return removed
@@ -0,0 +1,100 @@
+# Purpose: local, memory-mapped store of chunk metadata keyed by node.YTVideoChunk ids
+#
+# Layout of a store directory:
+#   chunks.idx  sorted fixed-width records: sha256 digest (32 bytes) | offset (u64) | length (u32)
+#   chunks.dat  concatenated utf-8 JSON metadata blobs (same fields as the Pinecone metadata)
+# Lookups binary-search the index through mmap, so opening a store reads nothing up front.
+
+import json
+import mmap
+import os
+import struct
+
+INDEX_FILE = 'chunks.idx'
+DATA_FILE = 'chunks.dat'
+RECORD = struct.Struct('<32sQI')
+
+def _digest(chunk_id: str) -> bytes:
+    return bytes.fromhex(chunk_id)
+
+def write_chunk_store(path: str, items) -> int:
+    """items: iterable of (chunk_id, metadata). Returns the number of chunks written"""
+    os.makedirs(path, exist_ok=True)
+    entries = []
+    with open(os.path.join(path, DATA_FILE + '.tmp'), 'wb') as data:
+        offset = 0
+        for chunk_id, metadata in items:
+            blob = json.dumps(metadata, separators=(',', ':')).encode()
+            data.write(blob)
+            entries.append((_digest(chunk_id), offset, len(blob)))
+            offset += len(blob)
+    entries.sort()
+    with open(os.path.join(path, INDEX_FILE + '.tmp'), 'wb') as index:
+        for entry in entries:
+            index.write(RECORD.pack(*entry))
+    # swap both files in only once they are complete
+    for name in (DATA_FILE, INDEX_FILE):
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+    return len(entries)
+
+def _map(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class ChunkStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index = _map(os.path.join(path, INDEX_FILE))
+        self.data = _map(os.path.join(path, DATA_FILE))
+        self.n = len(self.index) // RECORD.size
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _find(self, key: bytes):
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mid * RECORD.size
+            probe = self.index[start:start + 32]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return RECORD.unpack_from(self.index, start)
+        return None
+
+    def _lookup(self, chunk_id):
+        try:
+            return self._find(_digest(chunk_id))
+        except ValueError:
+            # not a sha256 hex id (e.g. NULL_ID)
+            return None
+
+    def __contains__(self, chunk_id) -> bool:
+        return self._lookup(chunk_id) is not None
+
+    def get(self, chunk_id: str):
+        "Returns the chunk's metadata dict, or None if the id is not in the store"
+        record = self._lookup(chunk_id)
+        if record is None:
+            return None
+        _, offset, length = record
+        return json.loads(self.data[offset:offset + length])
+
+    def get_many(self, chunk_ids) -> dict:
+        "Returns {id: metadata} for the ids found; missing ids are left out"
+        found = {}
+        for chunk_id in chunk_ids:
+            metadata = self.get(chunk_id)
+            if metadata is not None:
+                found[chunk_id] = metadata
+        return found
+
+    def close(self) -> None:
+        for m in (self.index, self.data):
+            if isinstance(m, mmap.mmap):
+                m.close()
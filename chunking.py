@@ -0,0 +1,52 @@
+# Purpose: chunk window boundaries for a whole transcript, computed with NumPy
+#
+# A window starts at a transcript line and takes every following line that starts
+# within `window` seconds (or, with max_tokens, while the estimated token count
+# fits). The next window starts `1 - overlap` of the way into the current one.
+# Boundaries are found with searchsorted over the start times / cumulative token
+# counts for all lines at once; only following the chain of chosen windows is a loop.
+
+import numpy as np
+
+WINDOW_SECONDS = 30
+
+def line_tokens(texts) -> np.ndarray:
+    # ~4 characters per token, like embeddings.estimate_tokens
+    return np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts)) // 4 + 1
+
+def window_bounds(starts, window=WINDOW_SECONDS, overlap=0.0, tokens=None, max_tokens=None):
+    """Returns (begins, ends): line index ranges [begin, end) of each chunk.
+
+    starts: line start times in seconds, ascending. Time windows by default; with
+    max_tokens, windows hold as many lines as fit in max_tokens given per-line `tokens`.
+    Every line ends up in a chunk, and chunks start on distinct whole seconds, so
+    ids derived from (video id, int(start)) stay unique."""
+    if not 0 <= overlap < 1:
+        raise ValueError('overlap must be in [0, 1)')
+    starts = np.asarray(starts, dtype=np.float64)
+    n = len(starts)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # for every line at once: where a window starting there ends, and where the next one starts
+    if max_tokens is None:
+        ends = np.searchsorted(starts, starts + window, side='right')
+        steps = np.searchsorted(starts, starts + window * (1 - overlap), side='right')
+    else:
+        cumulative = np.concatenate(([0], np.cumsum(tokens)))
+        ends = np.searchsorted(cumulative, cumulative[:-1] + max_tokens, side='right') - 1
+        steps = np.searchsorted(cumulative, cumulative[:-1] + max_tokens * (1 - overlap), side='right') - 1
+    # a window always takes its first line; the next starts at least one line and one
+    # whole second later, and the current one stretches up to it so no line is left out
+    seconds = np.floor(starts)
+    ends = np.maximum(ends, np.arange(1, n + 1))
+    following = np.maximum(steps, np.searchsorted(seconds, seconds + 1, side='left'))
+    ends = np.maximum(ends, np.minimum(following, n))
+
+    # follow the chain of windows from the first line
+    ends_list, following_list = ends.tolist(), following.tolist()
+    begins = [0]
+    while ends_list[begins[-1]] < n:
+        begins.append(following_list[begins[-1]])
+    begins = np.asarray(begins, dtype=np.int64)
+    return begins, ends[begins]
@@ -0,0 +1,76 @@
+# Purpose: columnar corpus of transcript chunks (Parquet), replacing the YTVideo pickle
+#
+# One row per chunk: id, video_id, timestamp, transcript, prev, next, title, created.
+# Rows are sorted by video_id then timestamp and split into row groups, so reads
+# filtered by video or date skip whole row groups using the Parquet statistics, and
+# only the requested columns are decoded. Files are read through a memory map.
+
+import os
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from node import YTVideo, YTVideoChunk
+
+CORPUS_PATH = './vivek_embeds/corpus.parquet'
+ROW_GROUP_SIZE = 2048
+
+SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('video_id', pa.string()),
+    ('timestamp', pa.int64()),
+    ('transcript', pa.string()),
+    ('prev', pa.string()),
+    ('next', pa.string()),
+    ('title', pa.string()),
+    ('created', pa.string()),
+])
+
+def write_corpus(path: str, videos) -> int:
+    """videos: iterable of node.YTVideo. Returns the number of chunks written"""
+    columns = { name: [] for name in SCHEMA.names }
+    for video in sorted(videos, key=lambda video: video.id):
+        for chunk in sorted(video.chunks, key=lambda chunk: chunk.timestamp):
+            columns['id'].append(chunk.id)
+            columns['video_id'].append(video.id)
+            columns['timestamp'].append(int(chunk.timestamp))
+            columns['transcript'].append(chunk.transcript)
+            columns['prev'].append(chunk.prev)
+            columns['next'].append(chunk.next)
+            columns['title'].append(video.title)
+            columns['created'].append(video.created)
+    table = pa.table(columns, schema=SCHEMA)
+    tmp = path + '.tmp'
+    pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression='zstd')
+    os.replace(tmp, path)
+    return table.num_rows
+
+def read_corpus(path: str = CORPUS_PATH, video_ids=None, since: str = None, until: str = None,
+                columns=None) -> pa.Table:
+    """Chunks of the given videos and/or created within [since, until] (ISO 8601 strings),
+    with only the given columns"""
+    filters = []
+    if video_ids is not None:
+        filters.append(('video_id', 'in', list(video_ids)))
+    if since is not None:
+        filters.append(('created', '>=', since))
+    if until is not None:
+        filters.append(('created', '<=', until))
+    return pq.read_table(path, columns=columns, filters=filters or None, memory_map=True)
+
+def load_videos(path: str = CORPUS_PATH, **filters) -> dict:
+    """video id -> node.YTVideo rebuilt from the corpus rows; filters as for read_corpus"""
+    table = read_corpus(path, **filters)
+    videos = OrderedDict()
+    chunks = {}
+    for row in table.to_pylist():
+        video_id = row['video_id']
+        if video_id not in videos:
+            videos[video_id] = (row['title'], row['created'])
+            chunks[video_id] = []
+        chunks[video_id].append(YTVideoChunk(video_id, row['transcript'], row['timestamp'], row['prev'], row['next']))
+    return {
+        video_id: YTVideo.from_chunks(video_id, title, created, chunks[video_id])
+        for video_id, (title, created) in videos.items()
+    }
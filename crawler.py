@@ -0,0 +1,147 @@
+# Purpose: parallel, rate-limited and resumable fetching of transcripts and video details
+#
+# Transcripts are fetched one video per request by a bounded worker pool, video details
+# in batches of 50 ids; both are paced by a token bucket and retried with backoff.
+# Every finished video is appended to a checkpoint file, so an interrupted run resumes
+# where it stopped. Results are keyed by video id; nothing is matched up by position.
+
+import functools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ratelimit import TokenBucket
+
+CHECKPOINT_PATH = './vivek_embeds/crawl_checkpoint.jsonl'
+LANGUAGES = ('en', 'en-US')
+TRANSCRIPT_WORKERS = 8
+TRANSCRIPTS_PER_SECOND = 4.0
+DETAILS_WORKERS = 4
+DETAILS_PER_SECOND = 5.0
+DETAILS_BATCH_SIZE = 50
+MAX_RETRIES = 4
+
+def fetch_transcript(video_id, languages=LANGUAGES) -> list:
+    from youtube_transcript_api import YouTubeTranscriptApi
+    return YouTubeTranscriptApi.get_transcript(video_id, languages=list(languages))
+
+def video_lister(api_key: str):
+    """Returns list_videos(ids) -> snippets by id, from the YouTube Data API.
+    API clients aren't thread-safe, so each worker thread builds its own."""
+    local = threading.local()
+
+    def list_videos(ids) -> dict:
+        if not hasattr(local, 'youtube'):
+            from googleapiclient.discovery import build
+            local.youtube = build('youtube', 'v3', developerKey=api_key)
+        response = local.youtube.videos().list(part='snippet', id=','.join(ids)).execute()
+        return { item['id']: item['snippet'] for item in response['items'] }
+    return list_videos
+
+def is_permanent(exc) -> bool:
+    "Errors that retrying won't fix, e.g. a video without (English) transcripts"
+    try:
+        from youtube_transcript_api import CouldNotRetrieveTranscript, TooManyRequests, YouTubeRequestFailed
+    except ImportError:
+        return False
+    return isinstance(exc, CouldNotRetrieveTranscript) and not isinstance(exc, (TooManyRequests, YouTubeRequestFailed))
+
+class Checkpoint:
+    """Append-only JSONL log of finished videos: {"kind": "transcript" | "details", "id": ..., "value": ...}"""
+    def __init__(self, path: str = CHECKPOINT_PATH) -> None:
+        self.path = path
+        self.transcripts = {}
+        self.details = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a run killed mid-write leaves a partial last line
+                        continue
+                    self._kind(entry['kind'])[entry['id']] = entry['value']
+
+    def _kind(self, kind) -> dict:
+        return self.transcripts if kind == 'transcript' else self.details
+
+    def record(self, kind: str, video_id: str, value) -> None:
+        line = json.dumps({'kind': kind, 'id': video_id, 'value': value}, separators=(',', ':'))
+        with self.lock:
+            self._kind(kind)[video_id] = value
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+    def clear(self) -> None:
+        "Called once the results are safely stored elsewhere"
+        with self.lock:
+            self.transcripts = {}
+            self.details = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+def with_retries(fn, limiter, max_retries=MAX_RETRIES, base_delay=1.0, max_delay=30.0):
+    """Calls fn() once the limiter allows, retrying transient errors with jittered backoff"""
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return fn()
+        except Exception as exc:
+            if is_permanent(exc) or attempt == max_retries:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+def _error(exc) -> str:
+    # youtube_transcript_api errors carry a long multi-line explanation
+    return (f'{type(exc).__name__}: {exc}'.strip().splitlines() or [''])[0]
+
+def crawl_transcripts(video_ids, checkpoint=None, fetch=fetch_transcript, workers=TRANSCRIPT_WORKERS,
+                      per_second=TRANSCRIPTS_PER_SECOND, max_retries=MAX_RETRIES, progress=None):
+    """Returns ({video_id: transcript}, {video_id: error}).
+    Videos already in the checkpoint are not fetched again. progress(video_id) is
+    called as each video finishes."""
+    done = checkpoint.transcripts if checkpoint is not None else {}
+    transcripts = { video_id: done[video_id] for video_id in video_ids if video_id in done }
+    failed = {}
+    limiter = TokenBucket(per_second, capacity=workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(with_retries, functools.partial(fetch, video_id), limiter, max_retries): video_id
+            for video_id in video_ids if video_id not in transcripts
+        }
+        for future in as_completed(futures):
+            video_id = futures[future]
+            try:
+                transcripts[video_id] = future.result()
+            except Exception as exc:
+                failed[video_id] = _error(exc)
+            else:
+                if checkpoint is not None:
+                    checkpoint.record('transcript', video_id, transcripts[video_id])
+            if progress is not None:
+                progress(video_id)
+    return transcripts, failed
+
+def crawl_details(video_ids, list_videos, checkpoint=None, workers=DETAILS_WORKERS,
+                  per_second=DETAILS_PER_SECOND, batch_size=DETAILS_BATCH_SIZE, max_retries=MAX_RETRIES):
+    """Returns {video_id: snippet} for the videos the API knows; list_videos as from video_lister()"""
+    done = checkpoint.details if checkpoint is not None else {}
+    details = { video_id: done[video_id] for video_id in video_ids if video_id in done }
+    todo = [ video_id for video_id in video_ids if video_id not in details ]
+    limiter = TokenBucket(per_second, capacity=workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(with_retries, functools.partial(list_videos, todo[i:i + batch_size]), limiter, max_retries)
+            for i in range(0, len(todo), batch_size)
+        ]
+        for future in as_completed(futures):
+            for video_id, snippet in future.result().items():
+                details[video_id] = snippet
+                if checkpoint is not None:
+                    checkpoint.record('details', video_id, snippet)
+    return details
@@ -0,0 +1,176 @@
+# Purpose: persistent, content-addressed embedding cache shared by ingestion and query time
+#
+# On-disk format: an append-only log starting with MAGIC, followed by records of
+#   sha256(model + normalized text) (32 bytes) | dim (u32) | dim x float32
+# The key -> offset table is rebuilt by scanning record headers on open; vectors
+# themselves are read lazily and kept in a byte-bounded in-memory LRU. Writers in
+# several processes append under an exclusive flock; a record is read back with its
+# header, and one whose key doesn't match is a miss rather than a wrong vector.
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha256
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+
+MAGIC = b'EMBC\x01\x00\x00\x00'
+HEADER = struct.Struct('<32sI')
+DEFAULT_PATH = './vivek_embeds/embedding_cache.bin'
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+def normalize(text: str) -> str:
+    return ' '.join(text.split())
+
+def cache_key(model: str, text: str) -> bytes:
+    return sha256(f'{model}\0{normalize(text)}'.encode()).digest()
+
+class EmbeddingCache:
+    def __init__(self, path: str = DEFAULT_PATH, max_memory_bytes: int = DEFAULT_MEMORY_BYTES) -> None:
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()   # key -> float32 ndarray, most recently used last
+        self.memory_bytes = 0
+        self.offsets = {}             # key -> (offset of vector data, dim)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a+b')
+        with self._locked():
+            self._scan()
+
+    @contextmanager
+    def _locked(self):
+        "Exclusive lock on the file across processes (a no-op where flock isn't available)"
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def _scan(self):
+        f = self.file
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            f.write(MAGIC)
+            f.flush()
+            return
+        f.seek(0)
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{self.path} is not an embedding cache file')
+        offset = len(MAGIC)
+        while offset + HEADER.size <= size:
+            f.seek(offset)
+            key, dim = HEADER.unpack(f.read(HEADER.size))
+            end = offset + HEADER.size + dim * 4
+            if end > size:
+                break
+            self.offsets[key] = (offset + HEADER.size, dim)
+            offset = end
+        if offset < size:
+            # drop a record torn by an interrupted write
+            f.truncate(offset)
+
+    def _remember(self, key, vec):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = vec
+        self.memory_bytes += vec.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def _lookup(self, key):
+        vec = self.memory.get(key)
+        if vec is not None:
+            self.memory.move_to_end(key)
+            return vec
+        location = self.offsets.get(key)
+        if location is None:
+            return None
+        offset, dim = location
+        record = os.pread(self.file.fileno(), HEADER.size + dim * 4, offset - HEADER.size)
+        if len(record) != HEADER.size + dim * 4 or HEADER.unpack_from(record) != (key, dim):
+            del self.offsets[key]
+            return None
+        vec = np.frombuffer(record, dtype=np.float32, offset=HEADER.size)
+        self._remember(key, vec)
+        return vec
+
+    def get(self, model: str, text: str):
+        "Returns the cached embedding as a list of floats, or None"
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts) -> list:
+        keys = [cache_key(model, text) for text in texts]
+        with self.lock:
+            vecs = [self._lookup(key) for key in keys]
+            n_hits = sum(vec is not None for vec in vecs)
+            self.hits += n_hits
+            self.misses += len(vecs) - n_hits
+        return [vec.tolist() if vec is not None else None for vec in vecs]
+
+    def put(self, model: str, text: str, embedding) -> None:
+        self.put_many(model, [text], [embedding])
+
+    def put_many(self, model: str, texts, embeddings) -> None:
+        with self.lock, self._locked():
+            chunks = []
+            # under the flock, so no other process appends between here and the write
+            offset = self.file.seek(0, os.SEEK_END)
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                if key in self.offsets:
+                    continue
+                vec = np.asarray(embedding, dtype=np.float32)
+                chunks.append(HEADER.pack(key, len(vec)))
+                chunks.append(vec.tobytes())
+                self.offsets[key] = (offset + HEADER.size, len(vec))
+                offset += HEADER.size + vec.nbytes
+                self._remember(key, vec)
+            if chunks:
+                self.file.write(b''.join(chunks))
+                self.file.flush()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.offsets),
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory_bytes,
+        }
+
+    def close(self) -> None:
+        self.file.close()
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_cache():
+    """Process-wide cache at EMBEDDING_CACHE_PATH (default ./vivek_embeds/embedding_cache.bin).
+    Setting EMBEDDING_CACHE_PATH to an empty string disables caching (returns None)."""
+    global _default_cache
+    if _default_cache is None:
+        path = os.environ.get('EMBEDDING_CACHE_PATH', DEFAULT_PATH)
+        if not path:
+            return None
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = EmbeddingCache(path)
+    return _default_cache
@@ -0,0 +1,131 @@
+# Purpose: batched, concurrent embedding + upsert stage for the ingestion run
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+from resources import openai_client
+import scheduler
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# ada-002 accepts up to 2048 inputs per request; stay well under the token ceiling
+MAX_BATCH_SIZE = 2048
+MAX_BATCH_TOKENS = 60000
+CONCURRENCY = 4
+MAX_RETRIES = 6
+UPSERT_BATCH_SIZE = 100
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+def normalize_text(text: str) -> str:
+    return text.replace("\n", " ")
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for packing batches
+    return len(text) // 4 + 1
+
+def pack_batches(texts, max_tokens=MAX_BATCH_TOKENS, max_size=MAX_BATCH_SIZE):
+    """Yields lists of indices into `texts`, each fitting the token and size budget"""
+    batch, batch_tokens = [], 0
+    for i, text in enumerate(texts):
+        n = estimate_tokens(text)
+        if batch and (batch_tokens + n > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += n
+    if batch:
+        yield batch
+
+def with_backoff(fn, max_retries=MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+    """Calls fn(), retrying throttling / transient errors with jittered exponential backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except RETRYABLE_ERRORS:
+            if attempt == max_retries:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+def create_embeddings(texts, model=EMBEDDING_MODEL) -> list:
+    """One Embedding.create call for a whole batch; results are in input order"""
+    inputs = [normalize_text(t) for t in texts]
+    res = scheduler.call('openai', lambda: openai_client().Embedding.create(input=inputs, model=model))
+    data = sorted(res['data'], key=lambda d: d['index'])
+    return [d['embedding'] for d in data]
+
+def embed_batches(texts, model=EMBEDDING_MODEL, max_batch_tokens=MAX_BATCH_TOKENS,
+                  max_batch_size=MAX_BATCH_SIZE, concurrency=CONCURRENCY, max_retries=MAX_RETRIES, cache=None):
+    """Embeds `texts` with several batches in flight at once.
+    Yields (indices, embeddings) per batch in completion order. Texts found in
+    `cache` (an embed_cache.EmbeddingCache) are yielded first without an API call.
+    Requests are paced by the upstream scheduler's OpenAI quota (scheduler.py)."""
+    todo = list(range(len(texts)))
+    if cache is not None:
+        cached = cache.get_many(model, texts)
+        hits = [i for i, embed in enumerate(cached) if embed is not None]
+        if hits:
+            yield hits, [cached[i] for i in hits]
+        todo = [i for i, embed in enumerate(cached) if embed is None]
+
+    def run(batch):
+        batch_texts = [texts[i] for i in batch]
+        embeds = with_backoff(lambda: create_embeddings(batch_texts, model=model), max_retries=max_retries)
+        if cache is not None:
+            cache.put_many(model, batch_texts, embeds)
+        return batch, embeds
+
+    batches = (
+        [todo[j] for j in batch]
+        for batch in pack_batches([texts[i] for i in todo], max_batch_tokens, max_batch_size)
+    )
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # keep a bounded window of requests in flight instead of submitting everything
+        in_flight = set()
+        for batch in batches:
+            in_flight.add(pool.submit(run, batch))
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in in_flight:
+            yield future.result()
+
+def embed_texts(texts, **kwargs) -> list:
+    """Like calling get_embedding on every text, but batched and concurrent"""
+    embeds = [None] * len(texts)
+    for batch, batch_embeds in embed_batches(texts, **kwargs):
+        for i, embed in zip(batch, batch_embeds):
+            embeds[i] = embed
+    return embeds
+
+def embed_records(records, **kwargs):
+    """records: list of (id, text, metadata). Yields (id, embedding, metadata) as batches finish"""
+    texts = [text for _, text, _ in records]
+    for batch, batch_embeds in embed_batches(texts, **kwargs):
+        for i, embed in zip(batch, batch_embeds):
+            id, _, metadata = records[i]
+            yield id, embed, metadata
+
+def upsert_batches(index, vectors, batch_size=UPSERT_BATCH_SIZE) -> int:
+    """Upserts an iterable of (id, values, metadata) in fixed-size requests. Returns count"""
+    batch, total = [], 0
+    for vector in vectors:
+        batch.append(vector)
+        if len(batch) >= batch_size:
+            index.upsert(vectors=batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        index.upsert(vectors=batch)
+        total += len(batch)
+    return total
@@ -0,0 +1,131 @@
+# Purpose: local BM25 index over chunk transcripts, for hybrid and embedding-free retrieval
+#
+# Directory layout (written at ingestion time, memory-mapped when opened):
+#   terms.json     sorted vocabulary; a term's position is its term id
+#   offsets.npy    uint64 (terms + 1): postings of term t are [offsets[t], offsets[t+1])
+#   docs.npy       uint32 document (row) numbers, ascending within each term
+#   tfs.npy        uint8 term frequency per posting, capped at 255
+#   lengths.npy    uint16 token count per document
+#   ids.npy        uint8 (documents x 32): sha256 digest of each document's chunk id
+#   meta.json      {'documents', 'avgdl', 'k1', 'b'}
+# search() returns the same shape as a vector backend query: {'matches': [{'id', 'score'}]}.
+
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+LEXICAL_INDEX_PATH = './vivek_embeds/lexical_index'
+K1 = 1.2
+B = 0.75
+
+TOKEN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+POSSESSIVE = re.compile(r"'s\b")
+STOPWORDS = frozenset('''
+a about after all also am an and any are as at be because been but by can could did do does
+for from had has have he her him his how i if in into is it its just me more my no not of on
+one or our out so some than that the their them then there these they this to up us was we
+were what when where which who why will with would you your
+'''.split())
+
+def tokenize(text: str) -> list:
+    "Lowercase word tokens without stopwords; keeps hyphenated terms like 'h-1b' whole"
+    return [ token for token in TOKEN.findall(POSSESSIVE.sub('', text.lower())) if token not in STOPWORDS ]
+
+def write_lexical_index(path: str, documents, k1: float = K1, b: float = B) -> int:
+    """documents: iterable of (chunk_id, transcript). Returns the number of documents"""
+    ids, counts = [], []
+    for chunk_id, text in documents:
+        ids.append(bytes.fromhex(chunk_id))
+        counts.append(Counter(tokenize(text)))
+    terms = sorted({ term for count in counts for term in count })
+    term_ids = { term: i for i, term in enumerate(terms) }
+
+    postings = [ [] for _ in terms ]
+    for doc, count in enumerate(counts):
+        for term, tf in count.items():
+            postings[term_ids[term]].append((doc, tf))
+    offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([ len(p) for p in postings ])
+    docs = np.fromiter((doc for p in postings for doc, _ in p), dtype=np.uint32, count=int(offsets[-1]))
+    tfs = np.fromiter((min(tf, 255) for p in postings for _, tf in p), dtype=np.uint8, count=int(offsets[-1]))
+    lengths = np.array([ min(sum(count.values()), 65535) for count in counts ], dtype=np.uint16)
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {'offsets.npy': offsets, 'docs.npy': docs, 'tfs.npy': tfs, 'lengths.npy': lengths,
+              'ids.npy': np.frombuffer(b''.join(ids), dtype=np.uint8).reshape(len(ids), 32)}
+    for name, array in arrays.items():
+        with open(os.path.join(path, name + '.tmp'), 'wb') as f:
+            np.save(f, array)
+    with open(os.path.join(path, 'terms.json.tmp'), 'w') as f:
+        json.dump(terms, f)
+    meta = {'documents': len(ids), 'avgdl': float(lengths.mean()) if len(ids) else 0.0, 'k1': k1, 'b': b}
+    with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    for name in list(arrays) + ['terms.json', 'meta.json']:
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+    return len(ids)
+
+class LexicalIndex:
+    def __init__(self, path: str = LEXICAL_INDEX_PATH) -> None:
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'terms.json')) as f:
+            self.term_ids = { term: i for i, term in enumerate(json.load(f)) }
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+        self.offsets = load('offsets.npy')
+        self.docs = load('docs.npy')
+        self.tfs = load('tfs.npy')
+        self.lengths = load('lengths.npy')
+        self.ids = load('ids.npy')
+        self.documents = meta['documents']
+        self.k1 = meta['k1']
+        # per-document length normalization, computed once
+        avgdl = meta['avgdl'] or 1.0
+        self.norms = (self.k1 * (1 - meta['b'] + meta['b'] * np.asarray(self.lengths, dtype=np.float32) / avgdl))
+
+    def __len__(self) -> int:
+        return self.documents
+
+    def idf(self, df):
+        return np.log(1 + (self.documents - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str):
+        "BM25 score of every document"
+        scores = np.zeros(self.documents, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.term_ids.get(term)
+            if t is None:
+                continue
+            start, end = int(self.offsets[t]), int(self.offsets[t + 1])
+            docs = self.docs[start:end]
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            scores[docs] += self.idf(end - start) * tfs * (self.k1 + 1) / (tfs + self.norms[docs])
+        return scores
+
+    def search(self, query: str, top_k: int = 10) -> dict:
+        scores = self.scores(query)
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return {'matches': []}
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return {'matches': [ {'id': bytes(self.ids[i]).hex(), 'score': float(scores[i])} for i in top ]}
+
+def confident(matches, margin: float = 1.5, min_score: float = 8.0) -> bool:
+    """Whether the lexical top hit is clear enough to answer without dense retrieval:
+    a high absolute BM25 score, well ahead of the runner-up"""
+    if not matches or matches[0]['score'] < min_score:
+        return False
+    return len(matches) == 1 or matches[0]['score'] >= margin * matches[1]['score']
+
+def fuse(rankings, top_k: int, k: int = 60) -> list:
+    """Reciprocal rank fusion of several ranked match lists; returns ids, best first"""
+    scores = {}
+    for matches in rankings:
+        for rank, match in enumerate(matches):
+            scores[match['id']] = scores.get(match['id'], 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
@@ -0,0 +1,86 @@
+# Purpose: ingestion manifest, so vectorize.py only re-embeds new or changed videos
+#
+# The manifest records, per video, a hash of its transcript and the chunk ids it
+# produced. Chunk ids are deterministic (node.hash_string(video_id + timestamp)),
+# so comparing old and new ids tells us exactly which vectors are stale. When the
+# config changes or a full rebuild is asked for, the recorded ids are kept as
+# retired until the rebuild replaces them, so the old vectors still get deleted.
+
+import json
+import os
+from hashlib import sha256
+
+MANIFEST_PATH = './vivek_embeds/manifest.json'
+VERSION = 1
+
+def _merge(*id_lists) -> list:
+    return list(dict.fromkeys(id for ids in id_lists for id in ids))
+
+def transcript_hash(transcript) -> str:
+    lines = [ (line['start'], line.get('duration'), line['text']) for line in transcript ]
+    return sha256(json.dumps(lines, separators=(',', ':')).encode()).hexdigest()
+
+class Manifest:
+    def __init__(self, path: str = MANIFEST_PATH, config: dict = None) -> None:
+        self.path = path
+        self.config = config or {}
+        self.videos = {}
+        self.retired = {}   # video id -> chunk ids of an invalidated build, still in the index
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.videos = data.get('videos', {})
+            self.retired = data.get('retired', {})
+            # a different chunking/embedding config invalidates everything recorded
+            if data.get('version') != VERSION or data.get('config') != self.config:
+                self.reset()
+
+    def reset(self) -> None:
+        "Forgets every video, so all are rebuilt; their chunk ids are kept as retired"
+        for video_id, entry in self.videos.items():
+            self.retired[video_id] = _merge(self.retired.get(video_id, []), entry['chunk_ids'])
+        self.videos = {}
+
+    def video_ids(self) -> set:
+        "Videos with vectors in the index, current or retired"
+        return set(self.videos) | set(self.retired)
+
+    def __contains__(self, video_id) -> bool:
+        return video_id in self.videos
+
+    def is_current(self, video_id, hash) -> bool:
+        entry = self.videos.get(video_id)
+        return entry is not None and entry['transcript_hash'] == hash
+
+    def chunk_ids(self, video_id) -> list:
+        entry = self.videos.get(video_id)
+        return _merge(entry['chunk_ids'] if entry is not None else [], self.retired.get(video_id, []))
+
+    def stale_chunk_ids(self, video_id, new_chunk_ids) -> list:
+        "Chunk ids recorded for the video that its new chunking no longer produces"
+        new_chunk_ids = set(new_chunk_ids)
+        return [ id for id in self.chunk_ids(video_id) if id not in new_chunk_ids ]
+
+    def record(self, video_id, hash, chunk_ids) -> None:
+        self.videos[video_id] = {'transcript_hash': hash, 'chunk_ids': list(chunk_ids)}
+        self.retired.pop(video_id, None)
+
+    def remove(self, video_id) -> list:
+        "Forgets the video and returns the chunk ids it had"
+        chunk_ids = self.chunk_ids(video_id)
+        self.videos.pop(video_id, None)
+        self.retired.pop(video_id, None)
+        return chunk_ids
+
+    def save(self) -> None:
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': VERSION, 'config': self.config, 'videos': self.videos, 'retired': self.retired}, f)
+        os.replace(tmp, self.path)
+
+def index_version(path: str = MANIFEST_PATH) -> str:
+    "Short fingerprint of the manifest; changes whenever an ingestion run changes the index"
+    if not os.path.exists(path):
+        return 'unversioned'
+    with open(path, 'rb') as f:
+        return sha256(f.read()).hexdigest()[:16]
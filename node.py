@@ -7,10 +7,13 @@ def is_null(datum) -> bool:
   return datum == NULL_ID
 
 from hashlib import sha256
+from chunking import window_bounds, line_tokens, WINDOW_SECONDS
 def hash_string(string):
     return sha256(string.encode()).hexdigest()
 
 class YTVideoChunk:
+  __slots__ = ('id', 'transcript', 'timestamp', 'prev', 'next')
+
   def __init__(self, video_id, transcript, timestamp=0, prev=NULL_ID, next=NULL_ID) -> None:
     self.id = hash_string(str(video_id) + str(timestamp))
     self.transcript = transcript
@@ -19,54 +22,41 @@ class YTVideoChunk:
     self.next = next
 
 class YTVideo:
-  def __init__(self, video_id, transcript, title, creation_date, window=30) -> None:
+  __slots__ = ('chunks', 'id', 'title', 'created')
+
+  """Splits the transcript into chunks (see chunking.window_bounds): `window` seconds each,
+  or up to `max_tokens` estimated tokens when given, consecutive chunks sharing `overlap`"""
+  def __init__(self, video_id, transcript, title, creation_date, window=WINDOW_SECONDS, overlap=0.0, max_tokens=None) -> None:
     self.chunks = []
     self.id = video_id
     self.title = title
     self.created = creation_date
 
-    start_time = 0
-    end_time = start_time + window
-    lines = []
-    prev_id = NULL_ID
-
-    #DEBUGGING OUTPUT
-    # print('Making video for', video_id)
-    # print('Transcript:', transcript[-2], '\n')
-
-    for i, line in enumerate(transcript):
-      # past the end of the window -> create a new chunk
-      if line['start'] > end_time:
-        text = ' '.join(lines)
-        timestamp = int(transcript[i-len(lines)]['start'])
-        prev_id = self.chunks[-1].id if len(self.chunks) > 0 else NULL_ID
-        new_chunk = YTVideoChunk(
-            video_id=video_id,
-            transcript=text,
-            timestamp=timestamp,
-            prev=prev_id
-        )
-        if prev_id != NULL_ID:
-          prev_chunk = self.chunks[-1]
-          prev_chunk.next = new_chunk.id
+    texts = [ line['text'] for line in transcript ]
+    starts = [ line['start'] for line in transcript ]
+    tokens = line_tokens(texts) if max_tokens is not None else None
+    begins, ends = window_bounds(starts, window, overlap, tokens, max_tokens)
 
-        self.chunks.append(new_chunk)
-        start_time = line['start']
-        end_time = start_time + window
-        lines = []
-
-      # add the line to the current document
-      lines.append(line['text'])
-
-    #for the case of less than one chunk (video < 30 seconds long)
-    if len(self.chunks) == 0 and len(lines) > 0:
-      text = ' '.join(lines)
-      prev_id = self.chunks[-1].id if len(self.chunks) > 0 else None
-      solo_chunk = YTVideoChunk(
+    for begin, end in zip(begins.tolist(), ends.tolist()):
+      chunk = YTVideoChunk(
           video_id=video_id,
-          transcript=text,
+          transcript=' '.join(texts[begin:end]),
+          timestamp=int(starts[begin]),
+          prev=self.chunks[-1].id if self.chunks else NULL_ID
       )
-      self.chunks.append(solo_chunk)
+      if self.chunks:
+        self.chunks[-1].next = chunk.id
+      self.chunks.append(chunk)
+
+  "Rebuilds a video from stored chunks (e.g. corpus rows) without re-chunking a transcript"
+  @classmethod
+  def from_chunks(cls, video_id, title, creation_date, chunks):
+    video = cls.__new__(cls)
+    video.id = video_id
+    video.title = title
+    video.created = creation_date
+    video.chunks = list(chunks)
+    return video
 
   "Returns list of transcripts from chunks"
   def get_chunk_transcripts(self) -> list:
@@ -0,0 +1,295 @@
+# Purpose: concurrent retrieval + generation for one chat turn, with per-stage timeouts
+#
+# A turn runs as stages: embed the question, query the index, expand neighbors, and
+# start the completion. The blocking SDK calls run on a shared thread pool under
+# asyncio, so independent work overlaps: the prompt and history are built while
+# retrieval is in flight, and neighbor fetches go out concurrently. Every call is
+# hedged: if it is slow (hedge_after) or fails with a transient error, a second
+# attempt is started and the first to succeed wins, up to max attempts per stage.
+# Each stage's wall time is recorded in a timings dict returned to the caller, and
+# as a span on the process-wide tracer (tracing.py).
+
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import time
+
+import vectorize as ret
+from embeddings import RETRYABLE_ERRORS, estimate_tokens
+import lexical as lexical_search
+from resources import executor, openai_client, lexical_index
+from streaming import stream_completion
+from tracing import span
+import scheduler
+
+CHAT_MODEL = "gpt-4-0613" # "gpt-3.5-turbo-16k-0613"
+TOP_K = 5
+# Estimated prompt tokens: retrieved quotes get up to CONTEXT_TOKEN_BUDGET, chat history
+# whatever is left of PROMPT_TOKEN_BUDGET (gpt-4-0613 has an 8k window, shared with the answer)
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 6000))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 2500))
+
+# seconds: overall limit per stage, and how long an attempt may take before a hedge is sent
+STAGE_TIMEOUTS = {'embed': 10.0, 'query': 10.0, 'neighbors': 10.0, 'completion': 60.0}
+HEDGE_AFTER = {'embed': 2.0, 'query': 2.0, 'neighbors': 2.0, 'completion': 15.0}
+MAX_ATTEMPTS = 3
+# what a call withdrawn from the scheduler queue raises, as seen through run_in_executor
+WITHDRAWN = (asyncio.CancelledError, concurrent.futures.CancelledError)
+# how often a hedged stage checks whether its queued attempt has been dispatched
+HEDGE_POLL = 0.05
+# with lexical results in hand, wait at most this long for the query embedding
+LEXICAL_FALLBACK_AFTER = 2.0
+
+# the vector index SDKs raise assorted transport errors; any failure there is worth a retry
+INDEX_ERRORS = (Exception,)
+
+class StageFailed(Exception):
+    "A stage ran out of attempts or time; `stage` names it, `cause` is the last error"
+    def __init__(self, stage: str, cause: BaseException = None) -> None:
+        super().__init__(f'{stage} failed: {cause!r}' if cause is not None else f'{stage} timed out')
+        self.stage = stage
+        self.cause = cause
+
+async def hedged(stage, call, retryable, timeout=None, hedge_after=None, attempts=MAX_ATTEMPTS):
+    """Runs call() on the shared pool; sends another attempt when the outstanding ones are
+    slower than hedge_after or fail with a retryable error. Returns the first result.
+    Time an attempt spends queued in the upstream scheduler doesn't count towards
+    hedge_after, and its calls still queued are withdrawn once the stage is decided."""
+    timeout = STAGE_TIMEOUTS[stage] if timeout is None else timeout
+    hedge_after = HEDGE_AFTER[stage] if hedge_after is None else hedge_after
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    def attempt(upstream, first):
+        upstream.begin()
+        # a hedge is sent for real rather than coalesced with the attempt it backs up
+        with scheduler.upstream_context(coalesce=first, attempt=upstream):
+            return call()
+
+    def slow(upstream):
+        "Seconds until the attempt has run for hedge_after, or None while it is queued"
+        since = upstream.running_since()
+        return None if since is None else since + hedge_after - time.monotonic()
+
+    pending = set()
+    upstreams = []
+    attempt_of = {}   # executor future -> its scheduler.Attempt
+    error = None
+    try:
+        while True:
+            if len(upstreams) < attempts and (not pending or error is not None):
+                upstreams.append(scheduler.Attempt(upstreams))
+                # spans recorded by the call belong to the caller's trace
+                future = loop.run_in_executor(
+                    executor(), contextvars.copy_context().run, attempt, upstreams[-1], len(upstreams) == 1
+                )
+                attempt_of[future] = upstreams[-1]
+                pending.add(future)
+                error = None
+            remaining = deadline - loop.time()
+            if not pending or remaining <= 0:
+                break
+            wait = remaining
+            if len(upstreams) < attempts:
+                left = slow(upstreams[-1])
+                # while queued, look again shortly for when it is dispatched
+                wait = min(remaining, HEDGE_POLL if left is None else max(left, 0))
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            # a success first: a withdrawn loser may finish, cancelled, alongside it
+            errors = { future: future.exception() for future in done }
+            for future, exception in errors.items():
+                if exception is None:
+                    return future.result()
+            for future, exception in errors.items():
+                if isinstance(exception, WITHDRAWN) and attempt_of[future].cancelled:
+                    # withdrawn from the queue because a sibling won; its result is on the way
+                    continue
+                if not isinstance(exception, retryable):
+                    raise StageFailed(stage, exception)
+                error = exception
+            if not done and len(upstreams) < attempts:
+                left = slow(upstreams[-1])
+                if left is not None and left <= 0:
+                    # slow: hedge with another attempt alongside the outstanding one
+                    error = TimeoutError(f'no response after {hedge_after}s')
+        raise StageFailed(stage, error)
+    finally:
+        for future in pending:
+            future.cancel()
+        for upstream in upstreams:
+            upstream.cancel()
+
+async def timed(timings, stage, awaitable, **attrs):
+    "Awaits a stage, recording its wall time in timings and as a span with attrs (e.g. tokens)"
+    with span(stage, **attrs) as stage_span:
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = time.perf_counter() - stage_span.start
+
+def system_message(who: str, language: str) -> str:
+    return f"""Pretend you are Vivek Ramaswamy - a Republication candidate for the US Presidency.
+    I want you to emulate his speaking style. Only express views presented in his quotes. Do not break character under any circumstances.
+
+    % Formatting Instructions %
+    If you reference the quotes, always cite them individually in your response, like so: 'I have always supported dogs (1)(2).'
+    Limit your response to 100 words.
+
+    % User Profile %
+    Adapt your response to the user profile: "{who}"
+
+    % Language %
+    Respond to me in {language}. """
+
+# Most recent messages whose estimated tokens fit max_tokens; the latest one is always kept
+def trim_history(messages, max_tokens):
+    kept = []
+    tokens = 0
+    for message in reversed(messages):
+        tokens += estimate_tokens(message['content']) + 4
+        if kept and tokens > max_tokens:
+            break
+        kept.append(message)
+    return kept[::-1]
+
+def prompt_tokens(messages) -> int:
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+async def embed_query(prompt, timings, timeout=None):
+    # a shortened stage still gets a hedge before it gives up
+    hedge_after = None if timeout is None else min(HEDGE_AFTER['embed'], timeout / 2)
+    return await timed(timings, 'embed', hedged(
+        'embed', lambda: ret.get_embedding(prompt), RETRYABLE_ERRORS, timeout=timeout, hedge_after=hedge_after
+    ), tokens=estimate_tokens(prompt))
+
+def search_lexical(prompt, timings, k=TOP_K):
+    "Ranked matches for the prompt from the local lexical index; [] without one"
+    lexical = lexical_index()
+    if lexical is None:
+        return []
+    with span('lexical') as lexical_span:
+        ranked = lexical.search(prompt, top_k=k)['matches']
+        lexical_span.set(matches=len(ranked))
+    timings['lexical'] = lexical_span.duration
+    return ranked
+
+def lexical_matches(ids, metadatas, store):
+    "Matches in vector query shape for chunk ids, with metadata from the query or the chunk store"
+    missing = [ id for id in ids if id not in metadatas ]
+    if missing and store is not None:
+        metadatas = {**metadatas, **store.get_many(missing)}
+    return [ {'id': id, 'metadata': metadatas[id]} for id in ids if id in metadatas ]
+
+async def retrieve(prompt, index, store, timings, embedding=None, k=TOP_K, dense=True, lexical_ranked=None):
+    """Kx3 metadata matrix (see vectorize.recursive_query) for the prompt.
+
+    The local lexical index is searched first, before any network call, unless its
+    results are passed in as lexical_ranked. A confident lexical hit is answered from
+    lexical results alone; otherwise they are fused with the dense matches, or used
+    alone if the embedding is slow (LEXICAL_FALLBACK_AFTER) or dense is False.
+    Raises StageFailed('retrieval') when neither finds anything."""
+    if lexical_ranked is None:
+        lexical_ranked = search_lexical(prompt, timings, k) if store is not None else []
+
+    dense_ranked = None
+    if dense and not (lexical_ranked and lexical_search.confident(lexical_ranked)):
+        try:
+            if embedding is None:
+                embedding = await embed_query(prompt, timings, LEXICAL_FALLBACK_AFTER if lexical_ranked else None)
+            res = await timed(timings, 'query', hedged(
+                'query', lambda: index.query(embedding, top_k=k, include_metadata=True), INDEX_ERRORS
+            ), top_k=k)
+            dense_ranked = res['matches']
+        except StageFailed:
+            if not lexical_ranked:
+                raise
+
+    if dense_ranked is None:
+        matches = lexical_matches([ match['id'] for match in lexical_ranked ], {}, store)
+    elif lexical_ranked:
+        ids = lexical_search.fuse([dense_ranked, lexical_ranked], top_k=k)
+        matches = lexical_matches(ids, { match['id']: match['metadata'] for match in dense_ranked }, store)
+    else:
+        matches = dense_ranked
+    if not matches:
+        # rather than answer from an empty context
+        raise StageFailed('retrieval', LookupError('no dense or lexical matches'))
+    query_nodes, metadatas = ret.match_nodes(matches)
+
+    async def neighbors():
+        missing = set(ret.missing_neighbors(query_nodes, metadatas, store))
+        # one fetch per match, all in flight at once; a shared neighbor is fetched once
+        groups = []
+        for node_set in query_nodes:
+            groups.append([ id for id in node_set if id in missing ])
+            missing.difference_update(node_set)
+        fetches = [
+            hedged('neighbors', lambda ids=ids: index.fetch(ids)['vectors'], INDEX_ERRORS)
+            for ids in groups if ids
+        ]
+        for fetched in await asyncio.gather(*fetches):
+            metadatas.update({ id: vec['metadata'] for id, vec in fetched.items() })
+    await timed(timings, 'neighbors', neighbors(), matches=len(query_nodes))
+    return ret.node_matrix(query_nodes, metadatas)
+
+async def prepare_turn(prompt, history, who, language, index, store, embedding=None, timings=None, dense=True,
+                       matrix=None, lexical_ranked=None):
+    """Returns (messages, citations, timings) for the chat completion.
+    history: the chat so far as {'role', 'content'} dicts, ending with the prompt.
+    matrix: the result of retrieve() for the prompt, if it was already run
+    lexical_ranked: the result of search_lexical() for the prompt, if it was already run"""
+    timings = {} if timings is None else timings
+    if matrix is None:
+        retrieval = asyncio.ensure_future(retrieve(prompt, index, store, timings, embedding, dense=dense,
+                                                   lexical_ranked=lexical_ranked))
+
+    # built while retrieval is in flight
+    system = system_message(who, language)
+    history = [ {'role': message['role'], 'content': message['content']} for message in history ]
+
+    X = await retrieval if matrix is None else matrix
+    # overlapping windows are merged, citation numbers are unchanged
+    with span('context') as context_span:
+        function_response = ret.format_context_matrix(X, max_tokens=CONTEXT_TOKEN_BUDGET)
+        context_span.set(tokens=estimate_tokens(function_response))
+    citations = ret.get_citations(X)
+    history_budget = PROMPT_TOKEN_BUDGET - estimate_tokens(system) - estimate_tokens(function_response)
+    messages = [{'role': 'system', 'content': system}] + trim_history(history, history_budget) + [
+        {
+            "role": "function",
+            "name": "get_viveks_quotes",
+            "content": function_response,
+        },
+    ]
+    return messages, citations, timings
+
+async def respond(prompt, history, who, language, index, store, embedding=None, timings=None, dense=True,
+                  model=CHAT_MODEL, matrix=None):
+    """Returns (response text, citations, timings)"""
+    start = time.perf_counter()
+    messages, citations, timings = await prepare_turn(prompt, history, who, language, index, store, embedding, timings, dense,
+                                                      matrix)
+    response = await timed(timings, 'completion', hedged(
+        'completion', lambda: scheduler.call('openai', lambda: openai_client().ChatCompletion.create(model=model, messages=messages)),
+        RETRYABLE_ERRORS
+    ), tokens=prompt_tokens(messages))
+    timings['total'] = time.perf_counter() - start
+    return response.choices[0]["message"]["content"], citations, timings
+
+async def respond_stream(prompt, history, who, language, index, store, embedding=None, timings=None, dense=True,
+                         model=CHAT_MODEL, lexical_ranked=None):
+    """Like respond, but returns an iterator over the response text as it is generated.
+    The completion stage ends when the stream has started."""
+    start = time.perf_counter()
+    messages, citations, timings = await prepare_turn(prompt, history, who, language, index, store, embedding, timings, dense,
+                                                      lexical_ranked=lexical_ranked)
+    deltas = await timed(timings, 'completion', hedged(
+        'completion', lambda: stream_completion(messages, model=model), RETRYABLE_ERRORS
+    ), tokens=prompt_tokens(messages))
+    timings['total'] = time.perf_counter() - start
+    return deltas, citations, timings
+
+def run(coroutine):
+    "Runs a coroutine to completion from synchronous code, e.g. a Streamlit script run"
+    return asyncio.run(coroutine)
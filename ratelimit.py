@@ -0,0 +1,39 @@
+# Purpose: thread-safe token bucket used to pace calls to external APIs
+
+import threading
+import time
+
+class TokenBucket:
+    """Allows `rate` units per second on average, with bursts of up to `capacity`."""
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Takes `amount` tokens if available; otherwise returns the seconds to wait"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: float = 1) -> None:
+        # requests larger than the bucket would never fit -> clamp to a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+def per_minute(requests_per_minute: float, burst: float = None) -> TokenBucket:
+    rate = requests_per_minute / 60.0
+    return TokenBucket(rate, burst if burst is not None else max(1.0, rate))
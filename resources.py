@@ -0,0 +1,167 @@
+# Purpose: process-wide, lazily created clients and static assets
+#
+# Streamlit re-executes app.py top to bottom on every interaction. Everything here
+# is created on first use and then shared by every rerun and session in the
+# process, so a rerun only pays for a few function calls.
+
+import functools
+import os
+import threading
+
+_lock = threading.RLock()
+
+def resource(fn):
+    """Caches fn() for the life of the process; concurrent first calls create it only once"""
+    value = []
+
+    @functools.wraps(fn)
+    def get():
+        if not value:
+            with _lock:
+                if not value:
+                    value.append(fn())
+        return value[0]
+    def override(replacement):
+        "Uses `replacement` from now on, e.g. a local stand-in in benchmarks"
+        with _lock:
+            value[:] = [replacement]
+    get.reset = value.clear
+    get.override = override
+    return get
+
+@resource
+def env() -> bool:
+    from dotenv import load_dotenv
+    load_dotenv()
+    return True
+
+@resource
+def openai_client():
+    env()
+    import openai
+    from scheduler import pooled_session, default_scheduler
+    # keep a key the caller set on the module (e.g. a benchmark) when the env has none
+    if os.environ.get('OPENAI_API_KEY'):
+        openai.api_key = os.environ['OPENAI_API_KEY']
+    # one keep-alive pool for every thread instead of a session per thread
+    openai.requestssession = pooled_session(default_scheduler().providers['openai'].concurrency)
+    return openai
+
+@resource
+def elevenlabs_client():
+    env()
+    import elevenlabs
+    elevenlabs.set_api_key(os.environ.get('ELEVENLABS_API_KEY'))
+    return elevenlabs
+
+@resource
+def elevenlabs_session():
+    "Keep-alive session for text-to-speech requests (responses.generate_audio)"
+    from scheduler import pooled_session, default_scheduler
+    elevenlabs = elevenlabs_client()
+    session = pooled_session(default_scheduler().providers['elevenlabs'].concurrency)
+    session.headers['xi-api-key'] = os.environ.get('ELEVENLABS_API_KEY') or ''
+    session.base_url = elevenlabs.api.base.api_base_url_v1
+    return session
+
+@resource
+def api_session():
+    "Keep-alive session to the answer API (api_client.py), for the Streamlit app"
+    import requests
+    return requests.Session()
+
+@resource
+def executor():
+    "Thread pool for blocking SDK calls made from asyncio code (orchestrator.py)"
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=int(os.environ.get('UPSTREAM_WORKERS', 32)))
+
+@resource
+def vector_index():
+    env()
+    from backends import get_backend
+    return get_backend()
+
+@resource
+def chunk_store():
+    from vectorize import load_chunk_store, CHUNK_STORE_PATH
+    return load_chunk_store(os.environ.get('CHUNK_STORE_PATH', CHUNK_STORE_PATH))
+
+@resource
+def lexical_index():
+    "BM25 index written at ingestion time, or None if there isn't one"
+    from lexical import LexicalIndex, LEXICAL_INDEX_PATH
+    path = os.environ.get('LEXICAL_INDEX_PATH', LEXICAL_INDEX_PATH)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    return LexicalIndex(path)
+
+@resource
+def audio_store():
+    from blob_store import BlobStore, BLOB_STORE_PATH
+    return BlobStore(os.environ.get('AUDIO_STORE_PATH', BLOB_STORE_PATH))
+
+def _audio_port() -> int:
+    from audio_server import AUDIO_SERVER_PORT
+    return int(os.environ.get('AUDIO_SERVER_PORT', AUDIO_SERVER_PORT))
+
+@resource
+def audio_server():
+    """Starts the audio endpoint once per process. If the port is already taken by another
+    process on this host (e.g. another Streamlit worker sharing the store), that one is used."""
+    env()
+    from audio_server import AudioServer
+    try:
+        return AudioServer(audio_store(), port=_audio_port()).start()
+    except OSError:
+        return None
+
+@resource
+def metrics_server():
+    """Serves the process-wide tracer's metrics at /metrics on METRICS_PORT (default 8503).
+    Like the audio endpoint, a port already taken by another worker is left to that one."""
+    from tracing import MetricsServer, METRICS_PORT, default_tracer
+    try:
+        return MetricsServer(default_tracer(), port=int(os.environ.get('METRICS_PORT', METRICS_PORT))).start()
+    except OSError:
+        return None
+
+def store_audio(audio: bytes):
+    "Stores the audio once and returns a lightweight BlobHandle to keep instead of the bytes"
+    return audio_store().put(audio)
+
+def audio_url(audio) -> str:
+    "URL the browser fetches the audio from; accepts a BlobHandle or bytes (stored first)"
+    from audio_server import audio_path
+    audio_server()
+    handle = store_audio(audio) if isinstance(audio, bytes) else audio
+    base = os.environ.get('AUDIO_BASE_URL', f'http://localhost:{_audio_port()}')
+    return base.rstrip('/') + audio_path(handle)
+
+def load_audio(handle):
+    "The audio bytes behind a handle, or None if they were evicted"
+    return audio_store().get(handle)
+
+@resource
+def filler_clips() -> tuple:
+    "URL of every filler clip; each is read and stored once, and only its URL kept"
+    from responses import N_STATEMENTS
+    urls = []
+    for idx in range(1, N_STATEMENTS + 1):
+        with open(f'audio/{idx}.wav', 'rb') as f:
+            urls.append(audio_url(f.read()))
+    return tuple(urls)
+
+_index_version = (None, None)
+
+def index_version() -> str:
+    "Fingerprint of the ingestion manifest, recomputed only when the file changes"
+    global _index_version
+    from manifest import MANIFEST_PATH, index_version as read_version
+    try:
+        mtime = os.stat(MANIFEST_PATH).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if _index_version[0] != mtime:
+        _index_version = (mtime, read_version(MANIFEST_PATH))
+    return _index_version[1]
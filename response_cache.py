@@ -0,0 +1,128 @@
+# Purpose: semantic cache of full answers (text, citations, audio) for near-duplicate questions
+#
+# Entries are partitioned by (who, language, index version, earlier turns): a
+# follow-up like "elaborate on that" only matches in the same conversation, and
+# opening questions are shared across conversations. Within a partition a
+# question hits if the cosine similarity of its embedding to a cached question is
+# above the threshold. Entries expire after a TTL and are evicted LRU-first once
+# the entry count or total byte size exceeds the cap.
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.95
+TTL_SECONDS = 6 * 60 * 60
+MAX_ENTRIES = 2000
+MAX_BYTES = 256 * 1024 * 1024
+
+class CachedResponse:
+    __slots__ = ('key', 'embedding', 'text', 'citations', 'audio', 'latency', 'created', 'nbytes')
+
+    def __init__(self, key, embedding, text, citations, audio, latency) -> None:
+        self.key = key
+        self.embedding = embedding
+        self.text = text
+        self.citations = citations
+        self.audio = audio
+        self.latency = latency
+        self.created = time.time()
+        # audio is usually a BlobHandle into the on-disk store; only raw bytes count here
+        audio_bytes = len(audio) if isinstance(audio, bytes) else 0
+        self.nbytes = audio_bytes + len(text.encode()) + embedding.nbytes
+
+class ResponseCache:
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, ttl=TTL_SECONDS,
+                 max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # entry id -> CachedResponse, least recently used first
+        self.partitions = {}           # key -> (entry ids, stacked embeddings) built lazily
+        self.nbytes = 0
+        self.next_id = 0
+        self.lookups = 0
+        self.hits = 0
+        self.latency_saved = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(who: str, language: str, index_version: str, history=()) -> tuple:
+        "history: the turns before the question, as {'role', 'content'} dicts"
+        turns = [ (message['role'], message['content']) for message in history ]
+        return (who.strip(), language, index_version, sha256(json.dumps(turns).encode()).hexdigest() if turns else '')
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        self.nbytes -= entry.nbytes
+        self.partitions.pop(entry.key, None)
+
+    def _matrix(self, key):
+        if key not in self.partitions:
+            ids = [ entry_id for entry_id, entry in self.entries.items() if entry.key == key ]
+            mat = np.stack([ self.entries[i].embedding for i in ids ]) if ids else None
+            self.partitions[key] = (ids, mat)
+        return self.partitions[key]
+
+    def lookup(self, embedding, key):
+        """Returns the CachedResponse for the most similar cached question, or None"""
+        q = np.asarray(embedding, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1)
+        with self.lock:
+            self.lookups += 1
+            ids, mat = self._matrix(key)
+            if mat is None:
+                return None
+            scores = mat @ q
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            entry_id = ids[best]
+            entry = self.entries[entry_id]
+            if time.time() - entry.created > self.ttl:
+                self._remove(entry_id)
+                return None
+            self.entries.move_to_end(entry_id)
+            self.hits += 1
+            self.latency_saved += entry.latency
+            return entry
+
+    def store(self, embedding, key, text, citations, audio, latency) -> None:
+        """latency: seconds it took to produce the answer, credited on every later hit"""
+        q = np.asarray(embedding, dtype=np.float32)
+        entry = CachedResponse(key, q / (np.linalg.norm(q) or 1), text, citations, audio, latency)
+        with self.lock:
+            self.entries[self.next_id] = entry
+            self.next_id += 1
+            self.nbytes += entry.nbytes
+            self.partitions.pop(key, None)
+            now = time.time()
+            for entry_id in [ i for i, e in self.entries.items() if now - e.created > self.ttl ]:
+                self._remove(entry_id)
+            while self.entries and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'latency_saved': self.latency_saved,
+        }
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_response_cache() -> ResponseCache:
+    "Process-wide cache shared by all sessions"
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+    return _default_cache
@@ -1,7 +1,12 @@
+import argparse
+import json
 import random
-import os
-from dotenv import load_dotenv
-from elevenlabs import set_api_key, generate, VoiceSettings, Voice, save
+import re
+from concurrent.futures import ThreadPoolExecutor
+from tts_cache import default_tts_cache, tts_key
+from resources import elevenlabs_client, elevenlabs_session
+import scheduler
+from streaming import spoken_sentences
 
 STATEMENTS = [
     "Hmm, that's a really thoughtful question. Let me ponder this for a moment.",
@@ -27,16 +32,57 @@ STATEMENTS = [
 ]
 N_STATEMENTS = len(STATEMENTS)
 
+VOICE_ID = 'lAZKsjhcbMmadBhSMtZk'
+VOICE_SETTINGS = dict(stability=0.3, similarity_boost=1, style=0.05, use_speaker_boost=True)
+TTS_MODEL = 'eleven_monolingual_v1'
+
+def strip_citations(text) -> str:
+    pattern = r"\((\d+)\)"
+    stripped_text = re.sub(pattern, '', text)
+    return stripped_text
+
+# Synthesize speech, reusing cached audio for text already spoken with the same voice
 def generate_audio(txt: str) -> bytes:
-    return generate(
-        text=txt,
-        voice=Voice(
-            voice_id='lAZKsjhcbMmadBhSMtZk',
-            settings=VoiceSettings(
-                stability=0.3, similarity_boost=1, style=0.05, use_speaker_boost=True
-            )
-        )
-    )
+    cache = default_tts_cache()
+    key = tts_key(txt, VOICE_ID, VOICE_SETTINGS, TTS_MODEL)
+    if cache is not None:
+        audio = cache.get(key)
+        if audio is not None:
+            return audio
+    # identical sentences in flight at the same time are synthesized once
+    audio = scheduler.call('elevenlabs', lambda: synthesize(txt), key=('tts', key))
+    if cache is not None:
+        cache.put(key, audio)
+    return audio
+
+def synthesize(txt: str) -> bytes:
+    "Text-to-speech request, as elevenlabs.generate makes it but over a keep-alive session"
+    session = elevenlabs_session()
+    response = session.post(f'{session.base_url}/text-to-speech/{VOICE_ID}', json={
+        'text': txt, 'model_id': TTS_MODEL, 'voice_settings': VOICE_SETTINGS
+    })
+    if response.status_code != 200:
+        raise elevenlabs_client().api.error.APIError(response.text, str(response.status_code))
+    return response.content
+
+def read_answers(path: str) -> list:
+    "Expected answers, one per line; .jsonl files are read from their 'text' field"
+    with open(path) as f:
+        lines = [ line.strip() for line in f if line.strip() ]
+    if path.endswith('.jsonl'):
+        return [ json.loads(line)['text'] for line in lines ]
+    return lines
+
+def warm_cache(answers, workers: int = 2) -> int:
+    """Pre-synthesizes answers into the TTS cache as the app speaks them: sentence by
+    sentence, without citations. Returns the number of sentences"""
+    texts = list(dict.fromkeys(
+        strip_citations(sentence) for answer in answers for sentence in spoken_sentences(answer)
+    ))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, _ in enumerate(pool.map(generate_audio, texts)):
+            print(f"Synthesized {i+1} of {len(texts)} sentences")
+    return len(texts)
 
 def get_timesaving_audio() -> bytes:
     #pick random number between 1 and N_STATEMENTS
@@ -49,14 +95,22 @@ def get_timesaving_audio() -> bytes:
 
 if __name__ == '__main__':
 
-    load_dotenv()
+    parser = argparse.ArgumentParser(description='Generate filler clips, or pre-synthesize expected answers')
+    parser.add_argument('--warm', metavar='FILE', help='text or .jsonl file of expected answers to pre-synthesize')
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    # Loads environment variables and sets the API key
+    elevenlabs = elevenlabs_client()
 
-    # Load environment variables
-    api_key = os.environ.get('ELEVENLABS_API_KEY')
-    set_api_key(api_key)
+    if args.warm:
+        scheduler.default_scheduler().default_priority = scheduler.BACKGROUND
+        n = warm_cache(read_answers(args.warm), workers=args.workers)
+        print(f"Warmed TTS cache with {n} sentences:", default_tts_cache().stats())
+        raise SystemExit
 
     for i, statement in enumerate(STATEMENTS):
         print(f"Generating audio for statement {i+1} of {len(STATEMENTS)}")
         audio = generate_audio(statement)
         path = f"audio/{i+1}.wav"
-        save(audio, path)
\ No newline at end of file
+        elevenlabs.save(audio, path)
\ No newline at end of file
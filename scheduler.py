@@ -0,0 +1,342 @@
+# Purpose: process-wide scheduler for upstream API calls (OpenAI, Pinecone, ElevenLabs)
+#
+# Every upstream call is queued with its provider and run on that provider's pool,
+# at most `concurrency` at a time and paced by a token bucket sized to the quota.
+# Queues are per priority - interactive calls are always dispatched before background
+# ones made in the same process - and, within a priority, per session: sessions take turns,
+# so one busy session can't hold up the others. A call made with a key while an
+# identical one is in flight shares its result instead of being sent again.
+# The scheduler and its quotas are per process: API workers split the quotas between
+# them (share_quotas), and a separate ingestion or --warm run has its own.
+# Queue depth is exported as gauges and queue wait time as 'queue.<provider>' spans
+# on the process-wide tracer (tracing.py). Calls made for a hedged attempt
+# (orchestrator.hedged) report when they are dispatched, so the hedge timer doesn't
+# count queueing, and are withdrawn from the queue once another attempt has won.
+
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ratelimit import per_minute
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# (concurrent requests, requests per minute); override with e.g. OPENAI_CONCURRENCY, OPENAI_RPM
+PROVIDERS = {
+    'openai': (16, 3500),
+    'pinecone': (16, 6000),
+    # ElevenLabs limits concurrent requests per plan
+    'elevenlabs': (5, 600),
+}
+
+# (priority, session, coalesce, attempt) of the calls made in this context; None = scheduler default
+_context = contextvars.ContextVar('upstream_context', default=(None, None, True, None))
+
+@contextmanager
+def upstream_context(priority=None, session=None, coalesce=None, attempt=None):
+    "Sets the priority, session, coalescing and Attempt of upstream calls made inside the block"
+    current = _context.get()
+    token = _context.set((
+        current[0] if priority is None else priority,
+        current[1] if session is None else session,
+        current[2] if coalesce is None else coalesce,
+        current[3] if attempt is None else attempt,
+    ))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+class SharedSession(requests.Session):
+    """Session shared by every thread of the process. close() is a no-op: the openai SDK
+    closes its session every few minutes, which would drop every pooled connection."""
+    def close(self):
+        pass
+
+def pooled_session(pool_size: int) -> SharedSession:
+    "Session keeping up to pool_size keep-alive connections per host"
+    session = SharedSession()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class Attempt:
+    """The upstream calls of one attempt of a hedged stage. running_since() is when
+    it last got going: when it began, or when its latest call left the queue; None
+    while a call is still queued. cancel() withdraws its calls that are still queued.
+    siblings: every attempt of the stage (including this one). Each attempt makes a single
+    upstream call, so when one succeeds the others are withdrawn before its slot is freed."""
+    def __init__(self, siblings=None) -> None:
+        self.siblings = siblings if siblings is not None else []
+        self.lock = threading.Lock()
+        self.since = time.monotonic()
+        self.waiting = 0
+        self.requests = []   # (provider, request)
+        self.cancelled = False
+
+    def begin(self) -> None:
+        with self.lock:
+            self.since = time.monotonic()
+
+    def running_since(self):
+        with self.lock:
+            return None if self.waiting else self.since
+
+    def _add(self, provider, request, queued: bool) -> bool:
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.requests.append((provider, request))
+            self.waiting += queued
+            return True
+
+    def _dispatched(self) -> None:
+        with self.lock:
+            self.waiting -= 1
+            self.since = time.monotonic()
+
+    def _won(self) -> None:
+        for sibling in list(self.siblings):
+            if sibling is not self:
+                sibling.cancel()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled = True
+            requests, self.requests = self.requests, []
+        for provider, request in requests:
+            provider.withdraw(request)
+
+class _Request:
+    __slots__ = ('fn', 'future', 'session', 'priority', 'key', 'enqueued', 'context', 'waiters', 'attempts', 'owners',
+                 'started')
+
+    def __init__(self, fn, future, session, priority, key) -> None:
+        self.fn = fn
+        self.future = future
+        self.session = session
+        self.priority = priority
+        self.key = key
+        self.enqueued = time.perf_counter()
+        # the call runs in the caller's context (trace id, upstream context)
+        self.context = contextvars.copy_context()
+        self.waiters = 1     # callers sharing the result; withdrawn once none is left
+        self.attempts = []   # hedged attempts waiting for it to be dispatched
+        self.owners = []     # every hedged attempt sharing it
+        self.started = False
+
+class Provider:
+    def __init__(self, name: str, concurrency: int, requests_per_minute: float, tracer=None) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = per_minute(requests_per_minute, burst=concurrency)
+        self.tracer = tracer
+        self.queues = { priority: OrderedDict() for priority in PRIORITIES }   # session -> deque of requests
+        self.queued = dict.fromkeys(PRIORITIES, 0)
+        self.in_flight = 0
+        self.pending_keys = {}   # key -> future of the queued or running call
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.withdrawn = 0
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'upstream-{name}')
+        self.dispatcher = threading.Thread(target=self._dispatch, name=f'dispatch-{name}', daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, fn, priority: int, session, key=None, attempt=None) -> Future:
+        with self.cond:
+            if key is not None and key in self.pending_keys:
+                request = self.pending_keys[key]
+                if not self._join(request, attempt):
+                    return _cancelled()
+                request.waiters += 1
+                self.coalesced += 1
+                return request.future
+            request = _Request(fn, Future(), session, priority, key)
+            if not self._join(request, attempt):
+                return _cancelled()
+            self.queues[priority].setdefault(session, deque()).append(request)
+            self.queued[priority] += 1
+            if key is not None:
+                self.pending_keys[key] = request
+            self.cond.notify_all()
+        return request.future
+
+    def _join(self, request, attempt) -> bool:
+        "Registers the attempt waiting for request; False if it was already cancelled"
+        if attempt is None:
+            return True
+        if not attempt._add(self, request, queued=not request.started):
+            return False
+        request.owners.append(attempt)
+        if not request.started:
+            request.attempts.append(attempt)
+        return True
+
+    def withdraw(self, request) -> None:
+        "One caller no longer needs the request; it leaves the queue if no other caller does"
+        with self.cond:
+            request.waiters -= 1
+            # cancel() fails once the request was dispatched
+            if request.waiters > 0 or not request.future.cancel():
+                return
+            sessions = self.queues[request.priority]
+            waiting = sessions[request.session]
+            waiting.remove(request)
+            if not waiting:
+                del sessions[request.session]
+            self.queued[request.priority] -= 1
+            if request.key is not None and self.pending_keys.get(request.key) is request:
+                del self.pending_keys[request.key]
+            self.withdrawn += 1
+
+    def _next(self):
+        "Oldest request of the next session in turn, at the highest priority with any waiting"
+        for priority in PRIORITIES:
+            sessions = self.queues[priority]
+            if sessions:
+                session, waiting = sessions.popitem(last=False)
+                request = waiting.popleft()
+                if waiting:
+                    # back of the line until every other waiting session had a turn
+                    sessions[session] = waiting
+                self.queued[priority] -= 1
+                return request
+        return None
+
+    def _dispatch(self):
+        while True:
+            with self.cond:
+                while self.in_flight >= self.concurrency or not any(self.queued.values()):
+                    self.cond.wait()
+                request = self._next()
+                # from here on the request can't be withdrawn
+                request.future.set_running_or_notify_cancel()
+                self.in_flight += 1
+            self.bucket.acquire()
+            if self.tracer is not None:
+                self.tracer.record(f'queue.{self.name}', time.perf_counter() - request.enqueued,
+                                   {'priority': PRIORITY_NAMES.get(request.priority, request.priority)})
+            self.pool.submit(self._run, request)
+
+    def _run(self, request):
+        with self.cond:
+            request.started = True
+            attempts, request.attempts = request.attempts, []
+        for attempt in attempts:
+            attempt._dispatched()
+        try:
+            result = request.context.run(request.fn)
+        except BaseException as error:
+            outcome = (None, error)
+        else:
+            outcome = (result, None)
+            with self.cond:
+                owners = list(request.owners)
+            # while this slot is still taken, so the losers can't be dispatched into it
+            for attempt in owners:
+                attempt._won()
+        with self.cond:
+            self.in_flight -= 1
+            if request.key is not None and self.pending_keys.get(request.key) is request:
+                del self.pending_keys[request.key]
+            if outcome[1] is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.cond.notify_all()
+        if outcome[1] is None:
+            request.future.set_result(outcome[0])
+        else:
+            request.future.set_exception(outcome[1])
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {'queued': { PRIORITY_NAMES[p]: n for p, n in self.queued.items() }, 'in_flight': self.in_flight,
+                    'completed': self.completed, 'failed': self.failed, 'coalesced': self.coalesced,
+                    'withdrawn': self.withdrawn,
+                    'sessions_waiting': sum(len(sessions) for sessions in self.queues.values())}
+
+def _cancelled() -> Future:
+    future = Future()
+    future.cancel()
+    return future
+
+def share_quotas(processes: int) -> None:
+    """Gives this process its 1/processes share of every provider's quota, when that many
+    processes call the same upstream accounts. Call before the scheduler is created."""
+    for name, (concurrency, requests_per_minute) in PROVIDERS.items():
+        concurrency = int(os.environ.get(f'{name.upper()}_CONCURRENCY', concurrency))
+        requests_per_minute = float(os.environ.get(f'{name.upper()}_RPM', requests_per_minute))
+        os.environ[f'{name.upper()}_CONCURRENCY'] = str(max(1, concurrency // processes))
+        os.environ[f'{name.upper()}_RPM'] = str(requests_per_minute / processes)
+
+class Scheduler:
+    def __init__(self, providers: dict = None, tracer=None, default_priority: int = INTERACTIVE) -> None:
+        self.default_priority = default_priority
+        self.providers = {}
+        for name, (concurrency, requests_per_minute) in (providers or PROVIDERS).items():
+            concurrency = int(os.environ.get(f'{name.upper()}_CONCURRENCY', concurrency))
+            requests_per_minute = float(os.environ.get(f'{name.upper()}_RPM', requests_per_minute))
+            self.providers[name] = Provider(name, concurrency, requests_per_minute, tracer)
+        if tracer is not None:
+            tracer.add_gauges(self.gauges)
+
+    def submit(self, provider: str, fn, key=None) -> Future:
+        """Queues fn() with `provider`; returns a Future. Priority and session come from the
+        current upstream_context; key (hashable) coalesces identical in-flight calls"""
+        priority, session, coalesce, attempt = _context.get()
+        return self.providers[provider].submit(
+            fn, self.default_priority if priority is None else priority, session, key if coalesce else None, attempt
+        )
+
+    def call(self, provider: str, fn, key=None):
+        """submit() and wait for the result; exceptions of fn are raised here, and
+        CancelledError if the call was withdrawn"""
+        return self.submit(provider, fn, key).result()
+
+    def stats(self) -> dict:
+        return { name: provider.stats() for name, provider in self.providers.items() }
+
+    def gauges(self):
+        "(metric, type, help, [(labels, value)]) for the Prometheus export"
+        stats = self.stats()
+        return [
+            ('upstream_queue_depth', 'gauge', 'Upstream calls waiting for a slot', [
+                ({'provider': name, 'priority': priority}, n)
+                for name, s in stats.items() for priority, n in s['queued'].items()
+            ]),
+            ('upstream_in_flight', 'gauge', 'Upstream calls running',
+             [ ({'provider': name}, s['in_flight']) for name, s in stats.items() ]),
+            ('upstream_coalesced_total', 'counter', 'Calls answered by an identical in-flight call',
+             [ ({'provider': name}, s['coalesced']) for name, s in stats.items() ]),
+        ]
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+def default_scheduler() -> Scheduler:
+    "Process-wide scheduler that every upstream call goes through"
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_lock:
+            if _default_scheduler is None:
+                from tracing import default_tracer
+                _default_scheduler = Scheduler(tracer=default_tracer())
+    return _default_scheduler
+
+def call(provider: str, fn, key=None):
+    "Runs fn() through the process-wide scheduler: `call('openai', lambda: ..., key=...)`"
+    return default_scheduler().call(provider, fn, key)
@@ -0,0 +1,186 @@
+# Purpose: the answer pipeline (retrieval -> LLM -> TTS) as an importable service, independent of any UI
+#
+# A turn is answered from the question, the chat history and the personalization
+# passed in; nothing is read from a UI session. answer_events() yields the turn as
+# events while it runs - text deltas, audio segment URLs, citations - for the HTTP
+# API (api_server.py) to stream to clients. get_response() / get_response_audio()
+# are the plain synchronous calls for scripts. Clients, indexes and caches are the
+# process-wide handles from resources.py.
+
+import asyncio
+import contextvars
+import random
+import re
+import threading
+import time
+
+import orchestrator
+from embeddings import estimate_tokens
+from resources import vector_index, chunk_store, filler_clips, index_version, audio_url, audio_store, store_audio
+from response_cache import ResponseCache, default_response_cache
+from responses import generate_audio, strip_citations
+from streaming import speak_stream
+from tracing import span, trace
+
+def extract_reference_numbers(text):
+    pattern = r"\((\d+)\)"
+    matches = re.findall(pattern, text)
+    references = [int(match[0]) for match in matches]
+    return references
+
+def used_citations(text, citations):
+    "[references, links] of the citations the answer refers to, as app.display_citations expects"
+    used_numbers = extract_reference_numbers(text)
+    return [ list(column) for column in zip(*[ citation for citation in citations if citation[0] in used_numbers ]) ]
+
+def get_response(prompt, history, who, language, embedding=None, timings=None, dense=True, matrix=None):
+    """Returns the response, a list of citations and per-stage latencies (orchestrator.py).
+    history: the chat so far as {'role', 'content'} dicts, ending with the prompt.
+    matrix: retrieval already done for this prompt (retrieve()), e.g. shared by several profiles.
+    Raises orchestrator.StageFailed when a stage is still failing after hedged retries."""
+    return orchestrator.run(orchestrator.respond(
+        prompt, history, who, language, vector_index(), chunk_store(), embedding=embedding, timings=timings, dense=dense,
+        matrix=matrix
+    ))
+
+def retrieve(prompt, timings=None):
+    "The retrieval stages of get_response on their own: the Kx3 context matrix for the prompt"
+    return orchestrator.run(orchestrator.retrieve(
+        prompt, vector_index(), chunk_store(), {} if timings is None else timings
+    ))
+
+def get_response_audio(response: str, strip: bool) -> bytes:
+    to_speak = strip_citations(response) if strip else response
+    with span('tts', tokens=estimate_tokens(to_speak)) as tts_span:
+        response_audio = generate_audio(to_speak)
+        tts_span.set(bytes=len(response_audio))
+    return response_audio
+
+def speak(sentence: str) -> bytes:
+    "get_response_audio for one sentence of a streamed answer; failures are StageFailed('tts')"
+    try:
+        return get_response_audio(sentence, strip=True)
+    except Exception as error:
+        raise orchestrator.StageFailed('tts', error) from error
+
+async def iterate_in_thread(iterator):
+    """Yields the items of a blocking iterator, which runs on a thread of its own
+    (not the shared pool: it is busy for the whole answer)"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    end = object()
+
+    def pump():
+        try:
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as error:
+            loop.call_soon_threadsafe(queue.put_nowait, (end, error))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (end, None))
+    # in the caller's context, so its trace id and upstream session carry over
+    threading.Thread(target=contextvars.copy_context().run, args=(pump,), daemon=True).start()
+    while True:
+        item, error = await queue.get()
+        if error is not None:
+            raise error
+        if item is end:
+            return
+        yield item
+
+async def answer_events(prompt, history, who, language):
+    """Answers one turn, yielding (event, data) pairs as it goes:
+
+    ('filler', {'url'})                   time-buying clip to play while the answer is prepared
+    ('status', {'timings'})               retrieval is done and the completion has started
+    ('text', {'delta'})                   answer text as it is generated
+    ('sentence', {'index'})               sentence `index` is complete
+    ('audio', {'index', 'url'})           audio of sentence `index`, in order
+    ('error', {'stage', 'message'})       an upstream stage failed; nothing follows
+    ('done', {'text', 'citations', 'audio', 'cached', 'timings'})
+
+    history: the chat so far as {'role', 'content'} dicts, ending with the prompt.
+    A near-duplicate question with the same personalization and earlier turns is answered
+    from the response cache with a single 'done' event."""
+    with trace(), span('turn') as turn_span:
+        turn_start = time.perf_counter()
+        timings = {}
+        response_cache = default_response_cache()
+        # history ends with the prompt; the turns before it are part of the key
+        cache_key = ResponseCache.make_key(who, language, index_version(), history[:-1])
+        # local, so before any network call
+        lexical_ranked = orchestrator.search_lexical(prompt, timings)
+        try:
+            # with lexical matches to fall back on, don't wait long for the embedding
+            fallback_after = orchestrator.LEXICAL_FALLBACK_AFTER if lexical_ranked else None
+            query_embedding = await orchestrator.embed_query(prompt, timings, fallback_after)
+        except orchestrator.StageFailed as failure:
+            query_embedding, cached = None, None
+            if not lexical_ranked:
+                turn_span.set(answered=False)
+                yield 'error', {'stage': failure.stage, 'message': str(failure)}
+                return
+        else:
+            with span('cache') as cache_span:
+                cached = response_cache.lookup(query_embedding, cache_key)
+                if cached is not None and cached.audio not in audio_store():
+                    # the audio was evicted from the blob store; answer afresh
+                    cached = None
+                cache_span.set(hit=cached is not None)
+
+        if cached is not None:
+            turn_span.set(cached=True, answered=True)
+            yield 'done', {'text': cached.text, 'citations': cached.citations, 'audio': audio_url(cached.audio),
+                           'cached': True, 'timings': timings}
+            return
+
+        yield 'filler', {'url': random.choice(filler_clips())}
+        try:
+            # slow or unavailable upstreams are retried with hedged requests first
+            deltas, all_citations, timings = await orchestrator.respond_stream(
+                prompt, history, who, language, vector_index(), chunk_store(), query_embedding, timings,
+                dense=query_embedding is not None, lexical_ranked=lexical_ranked
+            )
+        except orchestrator.StageFailed as failure:
+            turn_span.set(cached=False, answered=False)
+            yield 'error', {'stage': failure.stage, 'message': str(failure)}
+            return
+        yield 'status', {'timings': timings}
+
+        # Speak each sentence as soon as it is complete
+        assistant_response = ''
+        audio_segments = []
+        # from the first token to the last audio segment
+        with span('stream') as stream_span:
+            try:
+                async for event in iterate_in_thread(speak_stream(deltas, speak)):
+                    if event[0] == 'text':
+                        assistant_response += event[1]
+                        yield 'text', {'delta': event[1]}
+                    elif event[0] == 'sentence':
+                        yield 'sentence', {'index': event[1]}
+                    else:
+                        _, i, audio = event
+                        audio_segments.append(audio)
+                        yield 'audio', {'index': i, 'url': audio_url(audio)}
+            except Exception as error:
+                # the completion stream broke off, or a sentence could not be synthesized
+                failure = error if isinstance(error, orchestrator.StageFailed) else orchestrator.StageFailed('stream', error)
+                turn_span.set(cached=False, answered=False)
+                stream_span.error = type(failure.cause).__name__
+                yield 'error', {'stage': failure.stage, 'message': str(failure)}
+                return
+            stream_span.set(tokens=estimate_tokens(assistant_response),
+                            bytes=sum(len(audio) for audio in audio_segments))
+
+        # MP3 segments concatenate into one playable stream, stored once
+        audio_response = store_audio(b''.join(audio_segments))
+        citations = used_citations(assistant_response, all_citations)
+        if query_embedding is not None:
+            response_cache.store(
+                query_embedding, cache_key, assistant_response, citations, audio_response,
+                latency=time.perf_counter() - turn_start
+            )
+        turn_span.set(cached=False, answered=True)
+        yield 'done', {'text': assistant_response, 'citations': citations, 'audio': audio_url(audio_response),
+                       'cached': False, 'timings': timings}
@@ -0,0 +1,74 @@
+# Purpose: stream the chat completion and synthesize speech sentence by sentence
+#
+# Instead of waiting for the full completion and then the full TTS generation,
+# sentences are handed to TTS as soon as they are complete, so the first audio
+# segment is ready roughly one sentence into the answer.
+
+import contextvars
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from resources import openai_client
+import scheduler
+
+# sentence terminator, optionally followed by citations like '(1)(2)', then whitespace
+SENTENCE_END = re.compile(r'[.!?।]+(?:\s*\(\d+\))*(?=\s)')
+# very short fragments ('U.S.', 'Yes.') are merged with what follows
+MIN_SENTENCE_CHARS = 40
+TTS_WORKERS = 2
+
+def split_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS):
+    """Splits complete sentences off the front of `text`. Returns (sentences, rest)"""
+    sentences, start = [], 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+        if end - start >= min_chars:
+            sentences.append(text[start:end].strip())
+            start = end
+    return sentences, text[start:]
+
+def spoken_sentences(text: str) -> list:
+    "The sentences speak_stream synthesizes one by one for a complete answer"
+    sentences, rest = split_sentences(text)
+    return sentences + ([rest.strip()] if rest.strip() else [])
+
+def stream_completion(messages, model: str):
+    """Starts a streaming ChatCompletion and returns an iterator over its text deltas.
+    The request is sent eagerly so API errors surface here, not mid-iteration."""
+    response = scheduler.call('openai', lambda: openai_client().ChatCompletion.create(model=model, messages=messages, stream=True))
+
+    def deltas():
+        for chunk in response:
+            delta = chunk['choices'][0].get('delta', {}).get('content')
+            if delta:
+                yield delta
+    return deltas()
+
+def speak_stream(deltas, synthesize, max_workers: int = TTS_WORKERS):
+    """Consumes text deltas and synthesizes each complete sentence with `synthesize(sentence) -> bytes`.
+
+    Yields ('text', delta) as tokens arrive, ('sentence', i, text) when sentence i is
+    complete, and ('audio', i, bytes) as soon as it and every sentence before it
+    have been synthesized. synthesize runs in the caller's context (e.g. its trace id)."""
+    pending = deque()   # (sentence number, future), in sentence order
+    submitted = 0
+    buffer = ''
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for delta in deltas:
+            yield ('text', delta)
+            buffer += delta
+            sentences, buffer = split_sentences(buffer)
+            for sentence in sentences:
+                yield ('sentence', submitted, sentence)
+                pending.append((submitted, pool.submit(contextvars.copy_context().run, synthesize, sentence)))
+                submitted += 1
+            while pending and pending[0][1].done():
+                i, future = pending.popleft()
+                yield ('audio', i, future.result())
+
+        if buffer.strip():
+            yield ('sentence', submitted, buffer.strip())
+            pending.append((submitted, pool.submit(contextvars.copy_context().run, synthesize, buffer.strip())))
+        while pending:
+            i, future = pending.popleft()
+            yield ('audio', i, future.result())
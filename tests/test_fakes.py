@@ -0,0 +1,22 @@
+import numpy as np
+
+from benchmarks.fakes import FakePineconeIndex
+
+def vector(x, dim=4):
+    return [float(x)] * dim
+
+def test_fetch_delete_round_trip():
+    index = FakePineconeIndex(latency=0, dim=4)
+    index.upsert([('a', vector(1), {'n': 1}), ('b', vector(2), {'n': 2}), ('c', vector(3), {'n': 3})])
+    index.upsert([('d', vector(4), {'n': 4}), ('b', vector(5), {'n': 5}), ('d', vector(6), {'n': 6})])
+
+    fetched = index.fetch(['a', 'b', 'c', 'd'])['vectors']
+    assert { id: v['values'][0] for id, v in fetched.items() } == {'a': 1, 'b': 5, 'c': 3, 'd': 6}
+    assert fetched['d']['metadata'] == {'n': 6}
+
+    index.delete(['b'])
+    fetched = index.fetch(['a', 'b', 'c', 'd'])['vectors']
+    assert { id: v['values'][0] for id, v in fetched.items() } == {'a': 1, 'c': 3, 'd': 6}
+    assert index.vectors.shape == (3, 4)
+    top = index.query(np.ones(4), top_k=1)['matches'][0]
+    assert top['id'] == 'd'
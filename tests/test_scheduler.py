@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+import scheduler
+from orchestrator import StageFailed, hedged
+
+def blocked(release, result=None):
+    "fn that holds its slot until release is set"
+    def fn():
+        release.wait(5)
+        return result
+    return fn
+
+def test_withdraw_leaves_the_queue():
+    s = scheduler.Scheduler({'x': (1, 60000)})
+    release = threading.Event()
+    running = s.submit('x', blocked(release, 'first'))
+    queued = s.submit('x', lambda: 'second')
+    provider = s.providers['x']
+    attempt = scheduler.Attempt()
+    with scheduler.upstream_context(attempt=attempt):
+        withdrawn = s.submit('x', lambda: 'third')
+    attempt.cancel()
+    assert withdrawn.cancelled()
+    assert provider.stats()['withdrawn'] == 1
+    release.set()
+    assert running.result(5) == 'first' and queued.result(5) == 'second'
+    with pytest.raises(CancelledError):
+        withdrawn.result()
+
+def test_identical_calls_coalesce():
+    s = scheduler.Scheduler({'x': (2, 60000)})
+    release = threading.Event()
+    calls = []
+    def fn():
+        calls.append(1)
+        return blocked(release, 'shared')()
+    first, second = s.submit('x', fn, key='k'), s.submit('x', fn, key='k')
+    release.set()
+    assert first.result(5) == second.result(5) == 'shared'
+    assert len(calls) == 1 and s.providers['x'].stats()['coalesced'] == 1
+    # a coalesced call stays queued for the callers still waiting on it
+    release.clear()
+    s.submit('x', blocked(release))
+    s.submit('x', blocked(release))
+    shared = s.submit('x', lambda: 'kept', key='q')
+    attempt = scheduler.Attempt()
+    with scheduler.upstream_context(attempt=attempt):
+        s.submit('x', lambda: 'kept', key='q')
+    attempt.cancel()
+    release.set()
+    assert shared.result(5) == 'kept'
+
+def test_interactive_first_then_sessions_take_turns():
+    s = scheduler.Scheduler({'x': (1, 60000)})
+    release = threading.Event()
+    order = []
+    s.submit('x', blocked(release))
+    futures = []
+    for priority, session, name in ((scheduler.BACKGROUND, 'b', 'background'), (scheduler.INTERACTIVE, 'a', 'a1'),
+                                    (scheduler.INTERACTIVE, 'a', 'a2'), (scheduler.INTERACTIVE, 'c', 'c1')):
+        with scheduler.upstream_context(priority=priority, session=session):
+            futures.append(s.submit('x', lambda name=name: order.append(name)))
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ['a1', 'c1', 'a2', 'background']
+
+def test_hedge_clock_starts_at_dispatch():
+    s = scheduler.Scheduler({'x': (1, 60000)})
+    release = threading.Event()
+    s.submit('x', blocked(release))
+    calls = []
+    def call():
+        calls.append(1)
+        return s.call('x', lambda: 'answer')
+    async def stage():
+        threading.Timer(0.2, release.set).start()
+        return await hedged('embed', call, (TimeoutError,), timeout=5, hedge_after=0.05)
+    # queued for 0.2 s, four times hedge_after, without a hedge being sent
+    assert asyncio.run(stage()) == 'answer'
+    assert len(calls) == 1
+
+def test_withdrawn_loser_does_not_fail_the_stage():
+    s = scheduler.Scheduler({'x': (1, 60000)})
+    def call():
+        return s.call('x', lambda: time.sleep(0.02) or 'answer')
+    async def stage():
+        return await hedged('embed', call, (TimeoutError,), timeout=5, hedge_after=0.005, attempts=2)
+    for _ in range(50):
+        # the hedge queues behind the first attempt and is withdrawn when it wins
+        assert asyncio.run(stage()) == 'answer'
+    # nearly every run; one may finish before its hedge is sent
+    assert s.providers['x'].stats()['withdrawn'] > 25
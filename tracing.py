@@ -0,0 +1,225 @@
+# Purpose: lightweight per-stage tracing: spans, rolling latency percentiles, JSONL and Prometheus export
+#
+# A span times one stage of a turn (or of an ingestion run) and carries sizes such as
+# tokens and bytes. Finished spans update per-stage counters and a rolling window of
+# the most recent latencies; p50/p95/p99 are computed from it only when read. With
+# TRACE_PATH set, every span is also appended to a JSONL file (buffered, flushed about
+# once a second), tagged with the id of the turn it belongs to. /metrics on
+# METRICS_PORT serves the Prometheus text format, along with gauges other modules
+# register (e.g. upstream queue depth, scheduler.py). Recording a span takes a few
+# microseconds and no I/O on the caller's thread beyond a buffered write.
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+METRICS_PORT = 8503
+METRIC_PREFIX = 'paignful'
+WINDOW = 2048          # latencies kept per stage for the percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+FLUSH_INTERVAL = 1.0   # seconds between flushes of the JSONL file
+# span attributes that are also summed into per-stage counters
+SIZES = ('tokens', 'bytes')
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+class Span:
+    "Times a `with` block; attributes can be added while it runs with set()"
+    __slots__ = ('tracer', 'stage', 'attrs', 'start', 'duration', 'error')
+
+    def __init__(self, tracer, stage: str, attrs: dict) -> None:
+        self.tracer = tracer
+        self.stage = stage
+        self.attrs = attrs
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer.record(self.stage, self.duration, self.attrs, self.error)
+        return False
+
+class StageStats:
+    __slots__ = ('latencies', 'count', 'sum', 'errors', 'sizes')
+
+    def __init__(self, window: int) -> None:
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.sizes = dict.fromkeys(SIZES, 0)
+
+class Tracer:
+    def __init__(self, path: str = None, window: int = WINDOW) -> None:
+        self.path = path
+        self.window = window
+        self.stages = {}   # stage -> StageStats
+        self.gauge_sources = []
+        self.lock = threading.Lock()
+        self.file = None
+        self.flushed = time.monotonic()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, 'a', buffering=1024 * 1024)
+
+    def span(self, stage: str, **attrs) -> Span:
+        return Span(self, stage, attrs)
+
+    def record(self, stage: str, duration: float, attrs: dict = None, error: str = None) -> None:
+        "Records a finished span, e.g. a duration measured elsewhere"
+        attrs = attrs or {}
+        line = None
+        if self.file is not None:
+            line = json.dumps({
+                'time': round(time.time(), 3), 'trace': _trace.get(), 'stage': stage,
+                'duration': round(duration, 6), **({'error': error} if error else {}), **attrs
+            }, default=str) + '\n'
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats(self.window)
+            stats.latencies.append(duration)
+            stats.count += 1
+            stats.sum += duration
+            if error:
+                stats.errors += 1
+            for key in SIZES:
+                if attrs.get(key):
+                    stats.sizes[key] += attrs[key]
+            if line is not None:
+                self.file.write(line)
+                now = time.monotonic()
+                if now - self.flushed >= FLUSH_INTERVAL:
+                    self.file.flush()
+                    self.flushed = now
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def add_gauges(self, source) -> None:
+        "source() -> [(metric, type, help, [(labels, value)])], read on every export"
+        self.gauge_sources.append(source)
+
+    def reset(self) -> None:
+        "Forgets all stage statistics (the JSONL file is kept)"
+        with self.lock:
+            self.stages.clear()
+
+    def snapshot(self) -> dict:
+        """{stage: {'count', 'sum', 'errors', 'tokens', 'bytes', 'p50', 'p95', 'p99'}}, latencies in seconds"""
+        with self.lock:
+            copied = { stage: (list(s.latencies), s.count, s.sum, s.errors, dict(s.sizes)) for stage, s in self.stages.items() }
+        snapshot = {}
+        for stage, (latencies, count, total, errors, sizes) in sorted(copied.items()):
+            percentiles = np.percentile(latencies, [ q * 100 for q in QUANTILES ]) if latencies else [0.0] * len(QUANTILES)
+            snapshot[stage] = {'count': count, 'sum': total, 'errors': errors, **sizes,
+                               **{ f'p{q * 100:g}': float(p) for q, p in zip(QUANTILES, percentiles) }}
+        return snapshot
+
+    def prometheus(self) -> str:
+        "Prometheus text exposition of snapshot()"
+        snapshot = self.snapshot()
+        name = f'{METRIC_PREFIX}_stage_latency_seconds'
+        lines = [f'# HELP {name} Stage latency; quantiles over the last {self.window} spans per stage',
+                 f'# TYPE {name} summary']
+        for stage, stats in snapshot.items():
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q:g}"}} {stats[f"p{q * 100:g}"]:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+        for counter, help in [('errors', 'Spans that ended in an exception'),
+                              ('tokens', 'Estimated tokens processed'), ('bytes', 'Bytes produced')]:
+            name = f'{METRIC_PREFIX}_stage_{counter}_total'
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+            lines += [ f'{name}{{stage="{stage}"}} {stats[counter]}' for stage, stats in snapshot.items() ]
+        for source in self.gauge_sources:
+            for metric, kind, help, samples in source():
+                name = f'{METRIC_PREFIX}_{metric}'
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+                for labels, value in samples:
+                    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+                    lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+@contextmanager
+def trace(trace_id: str = None):
+    "Tags the spans recorded inside the block (in this thread or task) with one trace id; yields the id"
+    token = _trace.set(trace_id or uuid.uuid4().hex)
+    try:
+        yield _trace.get()
+    finally:
+        _trace.reset(token)
+
+def current_trace():
+    return _trace.get()
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body, content_type = self.server.tracer.prometheus().encode(), 'text/plain; version=0.0.4'
+        elif path == '/metrics.json':
+            body, content_type = json.dumps(self.server.tracer.snapshot()).encode(), 'application/json'
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tracer, host='0.0.0.0', port=METRICS_PORT) -> None:
+        super().__init__((host, port), MetricsRequestHandler)
+        self.tracer = tracer
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+_default_tracer = None
+_default_lock = threading.Lock()
+
+def default_tracer() -> Tracer:
+    """Process-wide tracer; spans are also written to TRACE_PATH when it is set"""
+    global _default_tracer
+    if _default_tracer is None:
+        with _default_lock:
+            if _default_tracer is None:
+                _default_tracer = Tracer(os.environ.get('TRACE_PATH') or None)
+                atexit.register(_default_tracer.flush)
+    return _default_tracer
+
+def span(stage: str, **attrs) -> Span:
+    "A span on the process-wide tracer: `with span('tts', chars=n) as s: ...; s.set(bytes=len(audio))`"
+    return default_tracer().span(stage, **attrs)
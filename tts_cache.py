@@ -0,0 +1,107 @@
+# Purpose: disk-backed, content-addressed cache of synthesized speech
+#
+# Audio is stored as <path>/<key[:2]>/<key>.mp3 where key hashes the spoken text
+# together with the voice id, voice settings and model. Least recently used files
+# (by mtime, refreshed on every hit) are evicted once the total exceeds max_bytes.
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+
+TTS_CACHE_PATH = './audio_cache'
+MAX_BYTES = 1024 * 1024 * 1024
+
+def tts_key(text: str, voice_id: str, settings: dict, model: str) -> str:
+    spec = json.dumps([' '.join(text.split()), voice_id, settings, model], sort_keys=True)
+    return sha256(spec.encode()).hexdigest()
+
+class TTSCache:
+    def __init__(self, path: str = TTS_CACHE_PATH, max_bytes: int = MAX_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()   # key -> size, least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._scan()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.mp3')
+
+    def _scan(self):
+        found = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.mp3'):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self.files[key] = size
+            self.nbytes += size
+
+    def get(self, key: str):
+        "Returns the cached audio bytes, or None"
+        with self.lock:
+            if key not in self.files:
+                self.misses += 1
+                return None
+            self.files.move_to_end(key)
+            self.hits += 1
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                audio = f.read()
+            os.utime(path)
+            return audio
+        except FileNotFoundError:
+            with self.lock:
+                self.nbytes -= self.files.pop(key, 0)
+            return None
+
+    def put(self, key: str, audio: bytes) -> None:
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp, path)
+        with self.lock:
+            self.nbytes += len(audio) - self.files.pop(key, 0)
+            self.files[key] = len(audio)
+            while self.nbytes > self.max_bytes and len(self.files) > 1:
+                evicted, size = self.files.popitem(last=False)
+                self.nbytes -= size
+                try:
+                    os.remove(self._file(evicted))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'files': len(self.files),
+            'bytes': self.nbytes,
+        }
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_tts_cache():
+    """Process-wide cache at TTS_CACHE_PATH (default ./audio_cache).
+    Setting TTS_CACHE_PATH to an empty string disables caching (returns None)."""
+    global _default_cache
+    if _default_cache is None:
+        path = os.environ.get('TTS_CACHE_PATH', TTS_CACHE_PATH)
+        if not path:
+            return None
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = TTSCache(path)
+    return _default_cache
@@ -1,27 +1,33 @@
 # Purpose: upsert data into database
 
 # import libraries
+import argparse
 import csv
 import os
 import random
-import openai
-import pinecone
-import pickle
-from youtube_transcript_api import YouTubeTranscriptApi
-from googleapiclient.discovery import build
-from dotenv import load_dotenv
-from tqdm import tqdm
-from node import YTVideo, is_null, NULL_ID
-
-load_dotenv()
-openai.api_key = os.environ.get('OPENAI_API_KEY')
-YT_api_key = os.environ.get('YOUTUBE_API_KEY')
-PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
-PINECONE_ENV = os.environ.get('PINECONE_ENV')
+from node import YTVideo, is_null, hash_string, NULL_ID
+from chunk_store import ChunkStore, write_chunk_store
+from embed_cache import default_cache
+from embeddings import estimate_tokens
+from resources import env, openai_client
+from tracing import span, default_tracer
+import scheduler
 
 def get_embedding(text, model="text-embedding-ada-002"):
    text = text.replace("\n", " ")
-   return openai.Embedding.create(input = [text], model=model)['data'][0]['embedding']
+   with span('embedding', tokens=estimate_tokens(text)) as embedding_span:
+      cache = default_cache()
+      if cache is not None:
+         embed = cache.get(model, text)
+         if embed is not None:
+            embedding_span.set(cached=True)
+            return embed
+      # identical questions in flight at the same time share one request
+      embed = scheduler.call('openai', lambda: openai_client().Embedding.create(input = [text], model=model),
+                             key=('embedding', model, text))['data'][0]['embedding']
+      if cache is not None:
+         cache.put(model, text, embed)
+      return embed
 
 # Define a function that takes seconds as an input and returns a string in '00:00:00' or '00:00' format
 def convert_seconds(seconds):
@@ -41,18 +47,21 @@ def convert_seconds(seconds):
         # Return an error message if the input is invalid
         return "Invalid input. Please enter a positive integer."
    
-"""returns Kx3 matrix of metadata, where rows are initially queried nodes,
-and columns are their 'related' (previous and next) children.
-the left or right spots will be filled with the NULL_ID
-if the queried node is the first or last in a video"""
-def recursive_query(db, query, K=2):
-  xq = get_embedding(query)
-  res = db.query([xq], top_k=K, include_metadata=True)
-  matches = res['matches']
+CHUNK_STORE_PATH = './vivek_embeds/chunk_store'
+CHUNK_WINDOW = 30
+CHUNK_OVERLAP = 0.0
+# bumped when chunk boundaries change for the same settings, so the manifest re-embeds everything
+CHUNKING_VERSION = 3
+
+def load_chunk_store(path=CHUNK_STORE_PATH):
+  "Opens the local chunk store written at ingestion time, or None if there isn't one"
+  if not os.path.exists(os.path.join(path, 'chunks.idx')):
+    return None
+  return ChunkStore(path)
 
-  # [ prev_1, id_1, next_1 ]
-  # [ prev_2, id_2, next_2 ]
-  # [... for k queries ]
+"""splits query matches into the Kx3 matrix of ids - [ prev_k, id_k, next_k ] for
+each match - and the metadata the query already returned for the matches themselves"""
+def match_nodes(matches):
   query_nodes = [
       [
           item['metadata']['prev'],
@@ -60,34 +69,98 @@ def recursive_query(db, query, K=2):
           item['metadata']['next']
       ] for item in matches
   ]
+  metadatas = { item['id']: item['metadata'] for item in matches }
+  return query_nodes, metadatas
 
-  fetch_response = [ db.fetch(ids=node_ids) for node_ids in query_nodes ]
-  query_vectors = [ res['vectors'] for res in fetch_response ]
+"""adds what the local chunk store has to metadatas; returns the ids still missing"""
+def missing_neighbors(query_nodes, metadatas, store=None):
+  neighbor_ids = { id for node_set in query_nodes for id in node_set if not is_null(id) } - metadatas.keys()
+  if store is not None:
+    metadatas.update(store.get_many(neighbor_ids))
+  return [ id for id in neighbor_ids if id not in metadatas ]
 
+def node_matrix(query_nodes, metadatas):
   #HANDLE NULL VALUES...
-  query_metadatas = [
+  return [
       [
-          query_vectors[i][id]['metadata'] if not is_null(id) else NULL_ID for id in node_set
-      ] for i, node_set in enumerate(query_nodes)
+          metadatas[id] if not is_null(id) else NULL_ID for id in node_set
+      ] for node_set in query_nodes
   ]
 
-  return query_metadatas
+"""returns Kx3 matrix of metadata, where rows are initially queried nodes,
+and columns are their 'related' (previous and next) children.
+the left or right spots will be filled with the NULL_ID
+if the queried node is the first or last in a video.
+neighbors are read from the local chunk store when given; ids it doesn't
+have are fetched from the db in a single batched call"""
+def recursive_query(db, query, K=2, store=None):
+  xq = get_embedding(query)
+  with span('query', top_k=K):
+    res = db.query(xq, top_k=K, include_metadata=True)
+  query_nodes, metadatas = match_nodes(res['matches'])
+  with span('neighbors', matches=len(query_nodes)) as neighbors_span:
+    missing = missing_neighbors(query_nodes, metadatas, store)
+    if missing:
+      fetched = db.fetch(missing)['vectors']
+      metadatas.update({ id: vec['metadata'] for id, vec in fetched.items() })
+    neighbors_span.set(fetched=len(missing))
+  return node_matrix(query_nodes, metadatas)
+
+def chunk_id(node):
+  "id of the chunk a metadata dict describes (as assigned by node.YTVideoChunk)"
+  return hash_string(str(node['video_id']) + str(int(node['timestamp'])))
+
+"""formats the Kx3 matrix from recursive_query as numbered quotes for the prompt.
+windows of the same video that overlap or touch are merged into one contiguous
+passage, so no transcript appears twice; a passage is labelled with the numbers
+of all the matches centered in it, which are the numbers get_citations gives them.
+with max_tokens, matched chunks are kept in rank order before any neighbors,
+and neighbors only next to a kept match, while the estimate stays within budget"""
+def format_context_matrix(mat, max_tokens=None):
+  candidates = [ (i, query[1], True) for i, query in enumerate(mat) ]
+  candidates += [
+      (i, node, False) for i, query in enumerate(mat) for node in (query[0], query[2]) if not is_null(node)
+  ]
+
+  chunks = {}    # id -> metadata of the chunks that go into the prompt
+  numbers = {}   # id -> citation numbers of the matches centered on it
+  tokens = 0
+  for i, node, is_center in candidates:
+    id = chunk_id(node)
+    if id in chunks:
+      continue
+    if not is_center and chunk_id(mat[i][1]) not in chunks:
+      continue
+    cost = estimate_tokens(node['transcript'])
+    if max_tokens is not None and tokens + cost > max_tokens:
+      continue
+    tokens += cost
+    chunks[id] = node
+    if is_center:
+      numbers[id] = [i+1]
+
+  # contiguous spans per video, following the chunks' next links
+  spans = []
+  ordered = sorted(chunks.items(), key=lambda item: (item[1]['video_id'], int(item[1]['timestamp'])))
+  for id, node in ordered:
+    if spans and spans[-1][-1][1]['next'] == id:
+      spans[-1].append((id, node))
+    else:
+      spans.append([(id, node)])
 
-def format_context_matrix(mat):
   formatted_queries = []
-  for i, query in enumerate(mat):
-    txt = [ node['transcript'] for node in query if not is_null(node) ]
-    center_node = query[1]
-    video_id = center_node['video_id']
-    # title = center_node['title']
-    # creation_date = center_node['created']
-    timestamp = int(center_node['timestamp'])
-    # readable_timestamp = convert_seconds(timestamp)
-    citation = f"({i+1})"
-    formatted_nodes = '\n'.join(txt)
-    formatted_query = f'{citation}: {formatted_nodes}'
-    formatted_queries.append(formatted_query)
-  return '\n\n'.join(formatted_queries)
+  for span in spans:
+    span_numbers = sorted(n for id, _ in span for n in numbers.get(id, []))
+    citation = ''.join(f"({n})" for n in span_numbers)
+    if len(span_numbers) > 1:
+      # several matches share the passage: mark where each one is
+      formatted_nodes = '\n'.join(
+          ''.join(f"({n}) " for n in numbers.get(id, [])) + node['transcript'] for id, node in span
+      )
+    else:
+      formatted_nodes = '\n'.join(node['transcript'] for _, node in span)
+    formatted_queries.append((span_numbers[0], f'{citation}: {formatted_nodes}'))
+  return '\n\n'.join(formatted for _, formatted in sorted(formatted_queries))
 
 def get_citations(mat):
     citations = []
@@ -102,86 +175,147 @@ def get_citations(mat):
 
 if __name__ == '__main__':
 
+    # ingestion-only dependencies; the app imports this module just for querying
+    from tqdm import tqdm
+    from crawler import Checkpoint, crawl_transcripts, crawl_details, video_lister
+    from embeddings import embed_records, upsert_batches, EMBEDDING_MODEL
+    from backends import get_backend
+    from manifest import Manifest, transcript_hash, MANIFEST_PATH
+    from corpus import write_corpus, load_videos, CORPUS_PATH
+    from lexical import write_lexical_index, LEXICAL_INDEX_PATH
+
+    env()
+    YT_api_key = os.environ.get('YOUTUBE_API_KEY')
+
+    parser = argparse.ArgumentParser(description='Upsert video transcripts into the vector index')
+    parser.add_argument('--full', action='store_true', help='ignore the manifest and rebuild everything')
+    parser.add_argument('--refresh', action='store_true', help='re-fetch transcripts of known videos to pick up edits')
+    parser.add_argument('--window', type=float, default=CHUNK_WINDOW, help='chunk length in seconds')
+    parser.add_argument('--overlap', type=float, default=CHUNK_OVERLAP, help='fraction of a chunk shared with the next')
+    parser.add_argument('--max-tokens', type=int, default=None, help='size chunks by estimated tokens instead of seconds')
+    args = parser.parse_args()
+    # ingestion yields to interactive turns served from this process
+    scheduler.default_scheduler().default_priority = scheduler.BACKGROUND
+
     print('Starting upsert.py...')
     #read in csv
     with open('./vivek_embeds/vivek_video_ids.txt') as f:
         reader = csv.reader(f)
         all_video_ids = [ row[0] for row in reader ]
 
-    #get transcript for each video_id
-    print('Getting transcripts...')
-    result = YouTubeTranscriptApi.get_transcripts(
-        video_ids=listvideo_ids,
-        languages=['en', 'en-US'],
-        continue_after_error=True
-    )
+    #manifest of what is already embedded; a changed chunking/model config starts it over,
+    #deleting the old vectors as their videos are rebuilt
+    chunking = {'window': args.window, 'overlap': args.overlap, 'max_tokens': args.max_tokens}
+    manifest = Manifest(MANIFEST_PATH, config={**chunking, 'chunking': CHUNKING_VERSION, 'model': EMBEDDING_MODEL})
+    if args.full:
+        manifest.reset()
 
-    # extract data from result
-    print('Extracting data...')
-    items = [ (video_id, transcript) for video_id, transcript in result[0].items() ]
-    video_ids, transcripts = zip(*items)
+    #previously built YTVideo objects, from the columnar corpus
+    ytvids = {}
+    if manifest.videos and os.path.exists(CORPUS_PATH):
+        ytvids = load_videos(CORPUS_PATH)
 
-    #get title for each video_id
-    youtube = build('youtube', 'v3', developerKey=YT_api_key)
+    to_fetch = [
+        video_id for video_id in all_video_ids
+        if args.refresh or video_id not in manifest or video_id not in ytvids
+    ]
 
-    # Get the video details from YouTube Data API
-    print('Getting video details...')
-    video_details = []
-    for i in range(0, len(video_ids), 50):
-        video_batch = youtube.videos().list(
-            part='snippet',
-            id=','.join(video_ids[i:i+50])
-        ).execute()
-        video_details.extend(video_batch['items'])
-    print('Extracting video details...')
-    items = [ 
-        (item['snippet']['title'], item['snippet']['publishedAt']) 
-        for item in video_details 
+    #get transcript for each new video_id, in parallel; an interrupted run resumes from the checkpoint
+    checkpoint = Checkpoint()
+    print(f'Getting transcripts for {len(to_fetch)} of {len(all_video_ids)} videos '
+          f'({len([ id for id in to_fetch if id in checkpoint.transcripts ])} from checkpoint)...')
+    with tqdm(total=len(to_fetch)) as bar, span('ingest.transcripts', videos=len(to_fetch)):
+        transcripts, failed = crawl_transcripts(to_fetch, checkpoint, progress=lambda _: bar.update())
+    for video_id, error in failed.items():
+        print(f'No transcript for {video_id}: {error}')
+
+    # only new videos or videos whose transcript changed need embedding
+    hashes = { video_id: transcript_hash(transcript) for video_id, transcript in transcripts.items() }
+    changed = [
+        video_id for video_id in transcripts
+        if not manifest.is_current(video_id, hashes[video_id]) or video_id not in ytvids
     ]
-    titles, creation_dates = zip(*items)
+    wanted = set(all_video_ids)
+    removed = [ video_id for video_id in manifest.video_ids() if video_id not in wanted ]
+    print(f'{len(changed)} new or changed videos, {len(removed)} removed')
+
+    # Get the video details from YouTube Data API, joined by video id
+    print('Getting video details...')
+    with span('ingest.details', videos=len(changed)):
+        video_details = crawl_details(changed, video_lister(YT_api_key), checkpoint)
 
     # iterate over data and create YTVideo objects
     print('Creating YTVideo objects...')
-    ytvids = []
-    iterable = zip(video_ids, transcripts, titles, creation_dates)
-    for video_id, transcript, title, creation_date in iterable:
-        ytvid = YTVideo(video_id, transcript, title, creation_date)
-        ytvids.append(ytvid)
-
-    #store YTVideo objects as pickle
-    print('Storing YTVideo objects...')
-    with open('./vivek_embeds/vivek_ytvids.pkl', 'wb') as f:
-        pickle.dump(ytvids, f)
-    
-    # OPTIONAL LINE: read in YTVideo objects from pickle
-    # with open('./vivek_embeds/vivek_ytvids.pkl', 'rb') as f:
-    #     ytvids = pickle.load(f)
-
-    #create index
-    print('Creating index...')
-    index_name = 'vivek-demo-v1'
-    pinecone.init(
-        api_key=PINECONE_API_KEY,
-        environment=PINECONE_ENV
-    )
+    stale_ids = []
+    built = []
+    with span('ingest.chunking', videos=len(changed)):
+        for video_id in changed:
+            if video_id not in video_details:
+                print(f'No details for {video_id}, skipping')
+                continue
+            snippet = video_details[video_id]
+            ytvid = YTVideo(video_id, transcripts[video_id], snippet['title'], snippet['publishedAt'], **chunking)
+            stale_ids.extend(manifest.stale_chunk_ids(video_id, ytvid.get_chunk_ids()))
+            ytvids[video_id] = ytvid
+            built.append(video_id)
+    for video_id in removed:
+        stale_ids.extend(manifest.remove(video_id))
+        ytvids.pop(video_id, None)
 
-    index = pinecone.Index(index_name)
+    #store chunks as the columnar corpus, one row per chunk
+    print('Storing corpus...')
+    with span('ingest.corpus', videos=len(ytvids)) as corpus_span:
+        write_corpus(CORPUS_PATH, ytvids.values())
+        corpus_span.set(bytes=os.path.getsize(CORPUS_PATH))
 
-    #upsert data for each video
+    #create index (VECTOR_BACKEND=local builds the in-process index instead of Pinecone)
+    print('Creating index...')
+    index = get_backend()
+
+    #embed chunks of new/changed videos in token-budgeted batches and upsert as they finish
     print('Upserting data...')
-    for vid in tqdm(ytvids):
+    records = []
+    to_embed = set(built)
+    for vid in ytvids.values():
         texts = vid.get_chunk_transcripts()
         metadatas = vid.get_chunk_metadatas()
         ids = vid.get_chunk_ids()
 
-        #TODO: change to title + created time + transcript + timestamp embedding
-        embeds = [ get_embedding(t) for t in texts ]
-
         for i, md in enumerate(metadatas):
             md['transcript'] = texts[i]
 
-        to_upsert = zip(ids, embeds, metadatas)
+        records.extend(zip(ids, texts, metadatas))
+
+    #write local chunk store so queries can expand neighbors without network calls
+    print('Writing chunk store...')
+    with span('ingest.chunk_store', chunks=len(records)):
+        write_chunk_store(CHUNK_STORE_PATH, ((id, md) for id, _, md in records))
+
+    #BM25 index over the same chunks, for lexical and hybrid retrieval
+    print('Writing lexical index...')
+    with span('ingest.lexical', chunks=len(records)):
+        write_lexical_index(LEXICAL_INDEX_PATH, ((id, text) for id, text, _ in records))
+
+    if stale_ids:
+        print(f'Deleting {len(stale_ids)} stale vectors...')
+        index.delete(stale_ids)
+
+    #TODO: change to title + created time + transcript + timestamp embedding
+    records = [ record for record in records if record[2]['video_id'] in to_embed ]
+    to_upsert = tqdm(embed_records(records, cache=default_cache()), total=len(records))
+    with span('ingest.upsert', chunks=len(records), tokens=sum(estimate_tokens(text) for _, text, _ in records)):
+        n_upserted = upsert_batches(index, to_upsert)
+        index.flush()
+    print(f'Upserted {n_upserted} vectors')
+    if default_cache() is not None:
+        print('Embedding cache:', default_cache().stats())
+
+    #record what is now in the index only once the upsert went through
+    for video_id in built:
+        manifest.record(video_id, hashes[video_id], ytvids[video_id].get_chunk_ids())
+    manifest.save()
+    checkpoint.clear()
 
-        upsert_response = index.upsert(
-            vectors=to_upsert
-        )
\ No newline at end of file
+    #time spent per stage in this run; with TRACE_PATH set, every span is in that file too
+    for stage, stats in default_tracer().snapshot().items():
+        print(f"{stage}: {stats['sum']:.1f} s over {stats['count']} spans")